@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from app.cache import TTLCache
+from app.config import ADMIN_CACHE_MAX_ENTRIES, ADMIN_CACHE_TTL, ADMIN_LOOKUP_CONCURRENCY
+from app.metrics import increment
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = {"administrator", "creator"}
+# Stored when get_chat_member fails (bot removed, chat gone), so the failure is not retried on every check.
+_UNKNOWN = ""
+
+# (chat_id, user_id) -> chat member status
+_STATUSES = TTLCache(ADMIN_CACHE_MAX_ENTRIES, ADMIN_CACHE_TTL)
+# (chat_id, user_id) -> task running a lookup already in progress
+_inflight = {}
+
+
+def record_member_status(chat_id, user_id, status):
+    """Store a status received from a chat_member update."""
+    _STATUSES.set((chat_id, user_id), status)
+
+
+def forget_chat(chat_id):
+    """Drop every cached status of a chat, e.g. after the bot was removed from it."""
+    for key in _STATUSES.keys():
+        if key[0] == chat_id:
+            _STATUSES.pop(key)
+
+
+async def _fetch_status(bot, chat_id, user_id):
+    increment("admin_lookups")
+    try:
+        member = await bot.get_chat_member(chat_id, user_id)
+    except Exception as exc:
+        logger.debug("get_chat_member(%s, %s) failed: %s", chat_id, user_id, exc)
+        return _UNKNOWN
+    return member.status
+
+
+async def _fetch_and_cache(bot, chat_id, user_id):
+    status = await _fetch_status(bot, chat_id, user_id)
+    _STATUSES.set((chat_id, user_id), status)
+    return status
+
+
+def _forget_inflight(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+
+
+async def get_member_status(bot, chat_id, user_id):
+    key = (chat_id, user_id)
+    status = _STATUSES.get(key)
+    if status is not None:
+        increment("admin_cache_hits")
+        return status
+
+    task = _inflight.get(key)
+    if task is None:
+        # A task of its own, so cancelling the caller that started the lookup does not cancel it for the others.
+        task = asyncio.create_task(_fetch_and_cache(bot, chat_id, user_id))
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _forget_inflight(key, done))
+    return await asyncio.shield(task)
+
+
+async def is_chat_admin(bot, chat_id, user_id):
+    return await get_member_status(bot, chat_id, user_id) in ADMIN_STATUSES
+
+
+async def filter_admin_chats(bot, user_id, chat_ids):
+    """Return the chats from `chat_ids` where the user is an admin, in the same order."""
+    chat_ids = list(chat_ids)
+    statuses = {chat_id: _STATUSES.get((chat_id, user_id)) for chat_id in chat_ids}
+    missing = [chat_id for chat_id, status in statuses.items() if status is None]
+    increment("admin_cache_hits", len(statuses) - len(missing))
+    if missing:
+        semaphore = asyncio.Semaphore(ADMIN_LOOKUP_CONCURRENCY)
+
+        async def lookup(chat_id):
+            async with semaphore:
+                statuses[chat_id] = await get_member_status(bot, chat_id, user_id)
+
+        await asyncio.gather(*(lookup(chat_id) for chat_id in missing))
+    return [chat_id for chat_id in chat_ids if statuses[chat_id] in ADMIN_STATUSES]
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+import aiofiles
+
+from app.bm25 import BM25Index
+from app.cache import TTLCache
+from app.config import (
+    ARCHIVE_CACHE_TTL,
+    ARCHIVE_CACHED_CHATS,
+    ARCHIVE_MEMORY_ENTRIES,
+    ARCHIVE_RECALL_LIMIT,
+    ARCHIVE_RECALL_MAX_CHARS,
+    ARCHIVE_RECALL_MIN_SCORE,
+)
+from app.state import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = DATA_DIR / "archive"
+
+# chat_id -> {"entries": [...], "first_id": doc id of entries[0], "index": BM25Index}
+_ARCHIVES = TTLCache(ARCHIVE_CACHED_CHATS, ARCHIVE_CACHE_TTL)
+# The in-memory tail is trimmed in batches of this size once it exceeds ARCHIVE_MEMORY_ENTRIES.
+_TRIM_BATCH = max(1, ARCHIVE_MEMORY_ENTRIES // 10)
+_archive_locks = {}
+
+
+def _get_archive_lock(chat_id):
+    lock = _archive_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _archive_locks[chat_id] = lock
+    return lock
+
+
+def _archive_file(chat_id):
+    return ARCHIVE_DIR / f"{chat_id}.jsonl"
+
+
+async def _read_archive_file(chat_id):
+    """The newest ARCHIVE_MEMORY_ENTRIES entries and how many older ones were skipped."""
+    path = _archive_file(chat_id)
+    entries = deque(maxlen=ARCHIVE_MEMORY_ENTRIES)
+    total = 0
+    if not path.exists():
+        return [], 0
+    try:
+        async with aiofiles.open(path, "r", encoding="utf-8") as stream:
+            async for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                total += 1
+    except OSError as exc:
+        logger.warning("Failed to read archive for chat %s: %s", chat_id, exc)
+    return list(entries), total - len(entries)
+
+
+async def _load_archive(chat_id):
+    archive = _ARCHIVES.get(chat_id)
+    if archive is not None:
+        return archive
+    entries, first_id = await _read_archive_file(chat_id)
+    index = BM25Index()
+    for position, entry in enumerate(entries):
+        index.add(first_id + position, entry.get("text", ""))
+    archive = {"entries": entries, "first_id": first_id, "index": index}
+    _ARCHIVES.set(chat_id, archive)
+    return archive
+
+
+def _trim_archive(archive):
+    excess = len(archive["entries"]) - ARCHIVE_MEMORY_ENTRIES
+    if excess <= 0:
+        return
+    excess = max(excess, _TRIM_BATCH)
+    for position, entry in enumerate(archive["entries"][:excess]):
+        archive["index"].remove(archive["first_id"] + position, entry.get("text", ""))
+    del archive["entries"][:excess]
+    archive["first_id"] += excess
+
+
+async def append_archive(chat_id, sender, text, role="user", ts=None):
+    """Append a message; `ts` is when it was received (default: now)."""
+    text = (text or "").strip()
+    if not text:
+        return
+    entry = {"ts": int(time.time() if ts is None else ts), "role": role, "sender": sender, "text": text}
+    async with _get_archive_lock(chat_id):
+        archive = await _load_archive(chat_id)
+        ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        try:
+            async with aiofiles.open(_archive_file(chat_id), "a", encoding="utf-8") as stream:
+                await stream.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            logger.warning("Failed to append to archive for chat %s: %s", chat_id, exc)
+            return
+        archive["entries"].append(entry)
+        archive["index"].add(archive["first_id"] + len(archive["entries"]) - 1, text)
+        if len(archive["entries"]) > ARCHIVE_MEMORY_ENTRIES + _TRIM_BATCH:
+            _trim_archive(archive)
+
+
+async def get_archive_entries(chat_id):
+    async with _get_archive_lock(chat_id):
+        archive = await _load_archive(chat_id)
+    return archive["entries"]
+
+
+async def search_archive(chat_id, query, limit=5, before=None, min_score=0.0):
+    """Return (entry, score) pairs ranked by BM25, ignoring entries received at or after `before`."""
+    async with _get_archive_lock(chat_id):
+        archive = await _load_archive(chat_id)
+    entries = archive["entries"]
+    first_id = archive["first_id"]
+    # How many of the best matches are too recent is not known up front, so rank them all.
+    ranked = archive["index"].search(query, limit if before is None else len(archive["index"]))
+    hits = []
+    for doc_id, score in ranked:
+        if score < min_score:
+            break
+        position = doc_id - first_id
+        if not 0 <= position < len(entries):
+            continue
+        entry = entries[position]
+        if before is not None and entry.get("ts", 0) >= int(before):
+            continue
+        hits.append((entry, score))
+        if len(hits) >= limit:
+            break
+    return hits
+
+
+def _clip(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "..."
+
+
+async def recall_relevant_turns(chat_id, prompt, history, received_at=None):
+    """
+    Format a few archived messages relevant to the prompt that are no longer in the live history.
+    `received_at` is when the (first) message being answered arrived; it and everything the
+    history covers are skipped by time, whatever else (untriggered group chatter) the archive holds.
+    """
+    if not prompt or ARCHIVE_RECALL_LIMIT <= 0:
+        return ""
+    times = [entry["ts"] for entry in history if entry.get("ts")]
+    if len(times) < len(history):
+        # History saved before turns were timestamped: what it covers is unknown.
+        return ""
+    if received_at is not None:
+        times.append(received_at)
+    hits = await search_archive(
+        chat_id,
+        prompt,
+        limit=ARCHIVE_RECALL_LIMIT,
+        before=min(times) if times else None,
+        min_score=ARCHIVE_RECALL_MIN_SCORE,
+    )
+    if not hits:
+        return ""
+    lines = ["Relevant earlier messages from this chat:"]
+    for entry, _ in sorted(hits, key=lambda hit: hit[0].get("ts", 0)):
+        lines.append(f"- {entry.get('sender') or 'User'}: {_clip(entry.get('text', ''), ARCHIVE_RECALL_MAX_CHARS)}")
+    return "\n".join(lines)
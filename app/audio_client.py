@@ -1,52 +1,217 @@
 import asyncio
 import logging
-import whisper
+import multiprocessing
+import os
+import threading
 import subprocess
 import tempfile
-import os
-import glob
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import (
+    STT_BACKEND,
+    STT_CHUNK_SECONDS,
+    STT_COMPUTE_TYPE,
+    STT_DEVICE,
+    STT_MODEL_SIZE,
+    STT_WORKERS,
+)
+from app.stt_backends import create_backend
 
 logger = logging.getLogger(__name__)
 
-_whisper_model = None
+SAMPLE_RATE = 16000
+# Chunk cuts are moved to the quietest _FRAME_SECONDS frame within this distance of the boundary.
+_SILENCE_SEARCH_SECONDS = 10
+_FRAME_SECONDS = 0.25
+
+_backend = None
+_backend_lock = threading.Lock()
+# Worker processes for long audio; each loads its own model on first use.
+_pool = None
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                # Backends import whisper/torch/ctranslate2 only in load(), which takes seconds.
+                logger.info("Loading local speech model (%s, %s)...", STT_BACKEND, STT_MODEL_SIZE)
+                _backend = create_backend(STT_BACKEND, STT_MODEL_SIZE, STT_COMPUTE_TYPE, STT_DEVICE).load()
+    return _backend
+
+def warm_up():
+    """Load the model and transcribe a second of silence so the first real request runs at full speed."""
+    import numpy as np
+
+    _get_backend().transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+
+def decode_audio(data: bytes):
+    """
+    Decode any ffmpeg-readable audio to the 16 kHz mono float32 NumPy buffer Whisper expects.
+
+    The bytes go through a single ffmpeg pipe. Containers that need a seekable input
+    (e.g. MP4 with the index at the end) fail on a pipe and are retried from a temp file.
+    """
+    import numpy as np
+
+    command = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1",
+    ]
+    result = subprocess.run(command, input=data, capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        logger.info("Decoding audio from a pipe failed, retrying from a temp file")
+        with tempfile.NamedTemporaryFile(suffix=".audio") as temp_audio:
+            temp_audio.write(data)
+            temp_audio.flush()
+            command[command.index("pipe:0")] = temp_audio.name
+            result = subprocess.run(command, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+def split_on_silence(audio, chunk_seconds):
+    """
+    Split audio into pieces of about `chunk_seconds`, moving each cut to the quietest
+    moment within _SILENCE_SEARCH_SECONDS of the boundary so words are not cut in half.
+    """
+    import numpy as np
 
-def _get_whisper_model():
-    global _whisper_model
-    if _whisper_model is None:
-        logger.info("Loading local Whisper model...")
-        _whisper_model = whisper.load_model("small")
-    return _whisper_model
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    search = int(_SILENCE_SEARCH_SECONDS * SAMPLE_RATE)
+    frame = int(_FRAME_SECONDS * SAMPLE_RATE)
+    chunks = []
+    start = 0
+    while len(audio) - start > chunk + search:
+        low = start + chunk - search
+        window = audio[low:start + chunk + search]
+        frames = len(window) // frame
+        energy = np.square(window[:frames * frame].reshape(frames, frame)).mean(axis=1)
+        cut = low + int(np.argmin(energy)) * frame + frame // 2
+        chunks.append(audio[start:cut])
+        start = cut
+    chunks.append(audio[start:])
+    return chunks
 
-def _transcribe_sync(file_path: str) -> str:
+def _init_worker(threads):
+    # Workers share the CPU cores instead of each starting a thread per core.
+    os.environ["OMP_NUM_THREADS"] = str(threads)
     try:
-        model = _get_whisper_model()
-        
-        file_size = os.path.getsize(file_path)
-        if file_size > 15 * 1024 * 1024:
-            logger.info("Audio exceeds the 15 MB limit, splitting it into chunks...")
-            with tempfile.TemporaryDirectory() as tmpdir:
-                base_name = os.path.join(tmpdir, "chunk_%03d.mp3")
-                cmd = [
-                    "ffmpeg", "-i", file_path,
-                    "-f", "segment", "-segment_time", "300",
-                    "-c:a", "libmp3lame",
-                    base_name
-                ]
-                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                
-                chunks = sorted(glob.glob(os.path.join(tmpdir, "chunk_*.mp3")))
-                full_text = []
-                for chunk in chunks:
-                    result = model.transcribe(chunk)
-                    full_text.append(result.get("text", "").strip())
-                return " ".join(full_text).strip()
-                
-        result = model.transcribe(file_path)
-        return result.get("text", "").strip()
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+def _transcribe_array(audio, language=None):
+    return _get_backend().transcribe(audio, language=language)
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        threads = max(1, (os.cpu_count() or 1) // STT_WORKERS)
+        # spawn, not fork: forking a process that already runs torch threads can deadlock.
+        _pool = ProcessPoolExecutor(
+            max_workers=STT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads,),
+        )
+    return _pool
+
+def warm_up_workers():
+    """
+    Start the long-audio worker processes and load the model in each of them, so the
+    first long voice message does not pay STT_WORKERS model loads. Blocks until done.
+    """
+    pool = _get_pool()
+    # Workers are spawned on demand, one per task nobody is idle for, so these land on different processes.
+    for future in [pool.submit(warm_up) for _ in range(STT_WORKERS)]:
+        future.result()
+
+def close_transcription_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _transcribe_sync(audio, language=None):
+    try:
+        return _transcribe_array(audio, language)
     except Exception as exc:
-        logger.error("Whisper transcription failed: %s", exc)
-        return ""
+        logger.error("Speech transcription failed: %s", exc)
+        return "", None
 
-async def transcribe_audio(file_path: str) -> str:
-    """Async wrapper around synchronous local Whisper transcription."""
-    return await asyncio.to_thread(_transcribe_sync, file_path)
+async def _transcribe_chunks(chunks, language, on_progress):
+    global _pool
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    futures = {
+        loop.run_in_executor(pool, _transcribe_array, chunk, language): index
+        for index, chunk in enumerate(chunks)
+    }
+    texts = [None] * len(chunks)
+    languages = Counter()
+    pending = set(futures)
+    reported = 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    texts[futures[future]], detected = future.result()
+                    if detected:
+                        languages[detected] += 1
+                except BrokenProcessPool as exc:
+                    logger.error("Transcription worker died: %s", exc)
+                    texts[futures[future]] = ""
+                    if _pool is pool:
+                        # The surviving workers would otherwise stay around with nobody to stop them.
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        _pool = None
+                except Exception as exc:
+                    logger.error("Transcription of chunk %d failed: %s", futures[future], exc)
+                    texts[futures[future]] = ""
+            finished = len(chunks) - len(pending)
+            if on_progress is None or finished == reported:
+                continue
+            reported = finished
+            # Only the leading run of finished chunks is shown, so the partial text reads in order.
+            prefix = []
+            for text in texts:
+                if text is None:
+                    break
+                prefix.append(text)
+            try:
+                await on_progress(finished, len(chunks), " ".join(part for part in prefix if part))
+            except Exception as exc:
+                logger.warning("Transcription progress update failed: %s", exc)
+    finally:
+        for future in pending:
+            future.cancel()
+    text = " ".join(text for text in texts if text).strip()
+    detected = languages.most_common(1)[0][0] if languages else language
+    return text, detected
+
+async def transcribe_audio(data: bytes, language=None, on_progress=None):
+    """
+    Transcribe in-memory audio with the STT_BACKEND model; returns (text, language code).
+
+    A `language` hint skips language detection. Audio longer than STT_CHUNK_SECONDS
+    is split at silences and the chunks are transcribed in parallel worker processes;
+    `await on_progress(done, total, text)` then reports each finished chunk with the
+    transcript so far.
+    """
+    try:
+        audio = await asyncio.to_thread(decode_audio, data)
+    except Exception as exc:
+        logger.error("Audio decoding failed: %s", exc)
+        return "", None
+    if not audio.size:
+        return "", None
+    chunks = split_on_silence(audio, STT_CHUNK_SECONDS)
+    if len(chunks) == 1:
+        return await asyncio.to_thread(_transcribe_sync, audio, language)
+    logger.info("Transcribing %.0fs of audio in %d chunks", audio.size / SAMPLE_RATE, len(chunks))
+    return await _transcribe_chunks(chunks, language, on_progress)
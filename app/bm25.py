@@ -0,0 +1,73 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Crude prefix stemming: Russian inflections mostly change word endings,
+# so comparing the first few characters matches "машина" with "машину".
+_STEM_LENGTH = 5
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall((text or "").casefold()):
+        if len(token) < 2 and not token.isdigit():
+            continue
+        tokens.append(token[:_STEM_LENGTH])
+    return tokens
+
+
+class BM25Index:
+    """Incremental in-memory inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, doc_id, text, tokens=None):
+        """Index `text`; pass `tokens` when the caller has already tokenized it."""
+        tokens = tokenize(text) if tokens is None else tokens
+        if not tokens or doc_id in self._doc_lengths:
+            return
+        for term, freq in Counter(tokens).items():
+            self._postings.setdefault(term, {})[doc_id] = freq
+        self._doc_lengths[doc_id] = len(tokens)
+        self._total_length += len(tokens)
+
+    def remove(self, doc_id, text, tokens=None):
+        """Drop a document; `text` (or `tokens`) must be what it was added with."""
+        length = self._doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        tokens = tokenize(text) if tokens is None else tokens
+        for term in set(tokens):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= length
+
+    def search(self, query, limit=5):
+        if not self._doc_lengths:
+            return []
+        doc_count = len(self._doc_lengths)
+        avg_length = self._total_length / doc_count
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings.items():
+                norm = 1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + self.k1 * norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
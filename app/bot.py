@@ -1,6 +1,22 @@
+import asyncio
 import logging
+import secrets
+import signal
+
 from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, ChatMemberHandler, filters
-from app.config import TELEGRAM_BOT_TOKEN
+from app.config import (
+    BOT_MODE,
+    MAX_CONCURRENT_UPDATES,
+    MAX_PENDING_UPDATES,
+    TELEGRAM_BOT_TOKEN,
+    WEBHOOK_LISTEN,
+    WEBHOOK_MAX_BODY_BYTES,
+    WEBHOOK_MAX_QUEUE,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_URL,
+)
 from app.handlers import (
     cancel_command,
     clear_mood_command,
@@ -9,6 +25,7 @@ from app.handlers import (
     help_command,
     image_command,
     post_init,
+    post_shutdown,
     reset_command,
     reset_kb_command,
     reset_settings_command,
@@ -23,22 +40,86 @@ from app.handlers import (
     web_app_data_handler,
     toggle_syntax_command,
     chat_member_handler,
+    member_status_handler,
     memory_command,
     truth_command,
     dare_command,
     never_command,
     summary_command,
     persona_command,
+    recall_command,
 )
+from app.update_processor import ChatOrderedUpdateProcessor
+from app.webhook_server import WebhookServer
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
 )
 
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ["message", "callback_query", "my_chat_member", "chat_member"]
+
+
+async def _run_webhook(application):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    secret_token = WEBHOOK_SECRET_TOKEN
+    if not secret_token:
+        if not WEBHOOK_URL:
+            raise RuntimeError("Webhook mode without WEBHOOK_URL needs WEBHOOK_SECRET_TOKEN to accept updates")
+        # Only Telegram needs to know it, and it is told in set_webhook below.
+        secret_token = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET_TOKEN is empty, using a random secret for this run")
+    server = WebhookServer(
+        application,
+        WEBHOOK_LISTEN,
+        WEBHOOK_PORT,
+        WEBHOOK_PATH,
+        secret_token=secret_token,
+        max_queue=WEBHOOK_MAX_QUEUE,
+        max_body_bytes=WEBHOOK_MAX_BODY_BYTES,
+    )
+    # Mirrors the lifecycle of Application.run_polling/run_webhook around our own HTTP server.
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=secret_token,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+        else:
+            logger.warning("WEBHOOK_URL is empty, the webhook is not registered with Telegram")
+        await server.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
 def main():
     application = (
-        Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
     )
 
     application.add_handler(CommandHandler("start", start_command))
@@ -53,6 +134,7 @@ def main():
     application.add_handler(CommandHandler("never", never_command))
     application.add_handler(CommandHandler("summary", summary_command))
     application.add_handler(CommandHandler("persona", persona_command))
+    application.add_handler(CommandHandler("recall", recall_command))
     application.add_handler(CommandHandler("settings", settings_command))
     application.add_handler(CommandHandler("image", image_command))
     application.add_handler(CommandHandler("setmood", set_mood_command))
@@ -73,7 +155,11 @@ def main():
         MessageHandler((filters.TEXT | filters.VOICE | filters.AUDIO | filters.VIDEO_NOTE | filters.PHOTO) & ~filters.COMMAND, handle_message)
     )
     application.add_handler(ChatMemberHandler(chat_member_handler, ChatMemberHandler.MY_CHAT_MEMBER))
-    application.run_polling(allowed_updates=["message", "callback_query", "my_chat_member"])
+    application.add_handler(ChatMemberHandler(member_status_handler, ChatMemberHandler.CHAT_MEMBER))
+    if BOT_MODE == "webhook":
+        asyncio.run(_run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+import asyncio
+import base64
+import json
+import logging
+import struct
+import time
+import zlib
+
+import aiofiles
+
+from app.config import CAPABILITY_RECHECK_SECONDS, OPENAI_BASE_URL, OPENAI_MODEL
+from app.llm_client import LLMRequestError, chat_completion
+from app.pipeline import _is_context_overflow_error, _is_message_header_error
+from app.state import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+CAPABILITIES_FILE = DATA_DIR / "model_capabilities.json"
+
+TOOLS = "tools"
+VISION = "vision"
+
+# "<base_url>|<model>" -> {capability: bool}; a capability that is absent is not known yet.
+_CAPABILITIES = {}
+# "<base_url>|<model>" -> {capability: time.time() of the failure} for unsupported capabilities.
+_CHECKED_AT = {}
+_capabilities_lock = asyncio.Lock()
+
+_PROBE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "ping",
+        "description": "Returns pong.",
+        "parameters": {"type": "object", "properties": {}},
+    },
+}
+
+
+def _probe_png(size=32):
+    """A size x size PNG, red on the left and blue on the right, built without Pillow."""
+    half = size // 2
+    row = b"\x00" + b"\xff\x00\x00" * half + b"\x00\x00\xff" * (size - half)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(row * size))
+        + chunk(b"IEND", b"")
+    )
+
+
+# Large enough for backends that reject tiny images, which a 1x1 probe would read as "no vision".
+_PROBE_IMAGE = base64.b64encode(_probe_png()).decode("ascii")
+
+
+def _backend_key():
+    return f"{OPENAI_BASE_URL}|{OPENAI_MODEL}"
+
+
+def supports(capability):
+    """
+    True/False once known for the configured model and endpoint, None before that.
+    "Not supported" expires after CAPABILITY_RECHECK_SECONDS so the next request tries again.
+    """
+    key = _backend_key()
+    supported = _CAPABILITIES.get(key, {}).get(capability)
+    if supported is False:
+        checked_at = _CHECKED_AT.get(key, {}).get(capability, 0)
+        if time.time() - checked_at > CAPABILITY_RECHECK_SECONDS:
+            return None
+    return supported
+
+
+# Words an error message uses for the rejected feature itself.
+_CAPABILITY_HINTS = {
+    TOOLS: ("tool", "function"),
+    VISION: ("image", "vision", "multimodal", "multi-modal"),
+}
+
+
+def is_capability_error(exc, capability):
+    """
+    The request was rejected because the model or server lacks `capability`, as opposed
+    to an outage, a rate limit, an overlong prompt or a template problem, which say
+    nothing about the feature and must not disable it.
+    """
+    if not isinstance(exc, LLMRequestError):
+        return False
+    # 5xx is an outage even when its message mentions images or tools.
+    if exc.status_code not in {400, 404, 415, 422}:
+        return False
+    if _is_context_overflow_error(exc) or _is_message_header_error(exc):
+        return False
+    detail = str(exc.detail).casefold()
+    return any(hint in detail for hint in _CAPABILITY_HINTS[capability])
+
+
+async def record_capability(capability, supported):
+    key = _backend_key()
+    known = _CAPABILITIES.setdefault(key, {})
+    if supported and known.get(capability) is True:
+        return
+    known[capability] = supported
+    if supported:
+        _CHECKED_AT.get(key, {}).pop(capability, None)
+    else:
+        _CHECKED_AT.setdefault(key, {})[capability] = time.time()
+    logger.info("Model %s: %s %s", OPENAI_MODEL, capability, "supported" if supported else "not supported")
+    async with _capabilities_lock:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        payload = {"capabilities": _CAPABILITIES, "checked_at": _CHECKED_AT}
+        try:
+            async with aiofiles.open(CAPABILITIES_FILE, "w", encoding="utf-8") as stream:
+                await stream.write(json.dumps(payload, ensure_ascii=False, indent=2))
+        except OSError as exc:
+            logger.warning("Failed to save model capabilities: %s", exc)
+
+
+async def load_capabilities():
+    if not CAPABILITIES_FILE.exists():
+        return
+    try:
+        async with aiofiles.open(CAPABILITIES_FILE, "r", encoding="utf-8") as stream:
+            raw = json.loads(await stream.read())
+    except (OSError, json.JSONDecodeError):
+        return
+    if not isinstance(raw, dict):
+        return
+    # Older files hold the capabilities at the top level, without failure times,
+    # so their negative entries count as expired and are checked again.
+    for key, known in raw.get("capabilities", raw).items():
+        if isinstance(known, dict):
+            _CAPABILITIES.setdefault(key, {}).update(known)
+    for key, checked in (raw.get("checked_at") or {}).items():
+        if isinstance(checked, dict):
+            _CHECKED_AT.setdefault(key, {}).update(checked)
+
+
+async def _probe(capability, messages, **kwargs):
+    try:
+        await chat_completion(messages, max_tokens=8, temperature=0, **kwargs)
+    except Exception as exc:
+        if is_capability_error(exc, capability):
+            await record_capability(capability, False)
+        else:
+            logger.warning("Capability probe for %s was inconclusive: %s", capability, exc)
+        return
+    await record_capability(capability, True)
+
+
+async def probe_capabilities():
+    """Check capabilities that are still unknown with tiny requests."""
+    if supports(TOOLS) is None:
+        await _probe(TOOLS, [{"role": "user", "content": "ping"}], tools=[_PROBE_TOOL], tool_choice="auto")
+    if supports(VISION) is None:
+        await _probe(
+            VISION,
+            [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "What colors are in this image?"},
+                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{_PROBE_IMAGE}"}},
+                    ],
+                }
+            ],
+        )
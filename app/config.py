@@ -18,6 +18,20 @@ OPENAI_BASE_URL =  _get_env("OPENAI_BASE_URL", "not-needed")
 OPENAI_MODEL = _get_env("OPENAI_MODEL", "not-needed")
 ALLOWED_USER_IDS = _get_env("ALLOWED_USER_IDS","")
 WEB_APP_URL = _get_env("WEB_APP_URL", "")
+
+# "polling" (default) or "webhook".
+BOT_MODE = _get_env("BOT_MODE", "polling").strip().casefold()
+# Loopback by default: put a TLS reverse proxy in front, or set 0.0.0.0 to listen on every interface.
+WEBHOOK_LISTEN = _get_env("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(_get_env("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = _get_env("WEBHOOK_PATH", "/telegram")
+# Public base URL registered with Telegram; leave empty to only accept locally posted updates.
+WEBHOOK_URL = _get_env("WEBHOOK_URL", "")
+# Required on every posted update (and on /metrics). When empty and WEBHOOK_URL is set, a random one
+# is generated at startup and registered with Telegram.
+WEBHOOK_SECRET_TOKEN = _get_env("WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_MAX_QUEUE = 1000
+WEBHOOK_MAX_BODY_BYTES = 1024 * 1024
 SYSTEM_PROMPT = (
     "You are a vivid, charismatic conversational partner.\n"
     "Your perceived identity, tone, and gendered self-reference should follow your name and the way people address you.\n"
@@ -39,11 +53,30 @@ HISTORY_LIMIT = 6
 MAX_TOKENS =  4096
 TEMPERATURE = 0.7
 REQUEST_TIMEOUT = 60
+# Check once at startup whether the model accepts tools and images (results are cached in data/).
+CAPABILITY_PROBE_ON_START = True
+# A capability found unsupported is tried again after this many seconds (the server may have been reconfigured).
+CAPABILITY_RECHECK_SECONDS = 24 * 3600
+# Updates from different chats are handled concurrently; updates within one chat stay ordered.
+# Background replies are capped by the same limit and also run in message order per chat.
+MAX_CONCURRENT_UPDATES = 16
+MAX_PENDING_UPDATES = 256
 CONTEXT_LIMIT_TOKENS = 32000
 TOKEN_CHAR_RATIO = 4
 MAX_RESPONSE_CHARS = 0
 FORMAT_WITH_LLM = True
 MAX_TELEGRAM_MESSAGE = 4096
+# Outgoing message pacing (Telegram allows ~30 msg/s overall, ~1 msg/s per chat and 20 msg/min per group).
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_RATE_PER_MIN = 20
+TELEGRAM_GROUP_BURST = 5
+TELEGRAM_SEND_MAX_RETRIES = 3
+# Chat member statuses used for admin checks are cached and refreshed from chat_member updates.
+ADMIN_CACHE_TTL = 600
+ADMIN_CACHE_MAX_ENTRIES = 50000
+ADMIN_LOOKUP_CONCURRENCY = 8
 ENFORCE_LAST_MESSAGE_PRIORITY = True
 PLAIN_TEXT_OUTPUT = True
 STRIP_MARKDOWN = False
@@ -52,11 +85,109 @@ CHECK_SYNTAX = False
 
 WEB_SEARCH_ENABLED = True
 WEB_SEARCH_PROVIDER = _get_env("WEB_SEARCH_PROVIDER", "serper")
+WEB_SEARCH_SERPER_URL = _get_env("WEB_SEARCH_SERPER_URL", "https://google.serper.dev/search")
 WEB_SEARCH_MAX_RESULTS = 5
 WEB_SEARCH_TIMEOUT = 15
+# Comma-separated providers to query concurrently instead of WEB_SEARCH_PROVIDER alone, e.g. "serper,duckduckgo".
+WEB_SEARCH_PROVIDERS = [
+    item.strip().casefold()
+    for item in _get_env("WEB_SEARCH_PROVIDERS", "").split(",")
+    if item.strip()
+]
+# "first" returns the first non-empty response and cancels the others;
+# "merge" combines everything that arrived within WEB_SEARCH_FANOUT_DEADLINE seconds, deduplicated by URL.
+WEB_SEARCH_FANOUT = _get_env("WEB_SEARCH_FANOUT", "first").strip().casefold()
+WEB_SEARCH_FANOUT_DEADLINE = 4
+# Deep search: also fetch the top result pages and give the LLM their main text, not just snippets.
+DEEP_SEARCH_ENABLED = _get_env("DEEP_SEARCH_ENABLED", "0").strip() == "1"
+DEEP_SEARCH_PAGES = 3
+PAGE_FETCH_TIMEOUT = 8
+PAGE_FETCH_MAX_BYTES = 1024 * 1024
+PAGE_TEXT_MAX_CHARS = 4000
+PAGE_CACHE_SIZE = 300
+PAGE_CACHE_TTL = 3600
+# Result pages on loopback, private and link-local addresses are refused; "1" allows them (local benchmarks only).
+PAGE_FETCH_ALLOW_PRIVATE = _get_env("PAGE_FETCH_ALLOW_PRIVATE", "0").strip() == "1"
+# Search results are compressed to the most query-relevant sentences within this many tokens per query.
+SEARCH_CONTEXT_TOKENS = 2000
+# Prompts the local intent router classifies with at least this confidence skip the LLM routing call.
+INTENT_CONFIDENCE = 0.7
+# How ambiguous prompts pick a tool: "router" asks the LLM in a separate routing request first,
+# "single_pass" offers the tools in the reply request itself and feeds tool results back.
+TOOL_CALLING_MODE = _get_env("TOOL_CALLING_MODE", "router").strip().casefold()
+# Tool calls returned together run concurrently; searches still running after the timeout are dropped.
+MAX_TOOL_CALLS = 4
+TOOL_CALLS_TIMEOUT = 20
+# Raw provider results are cached per (normalized query, provider, limit) for SEARCH_CACHE_TTL seconds.
+SEARCH_CACHE_SIZE = 1000
+SEARCH_CACHE_TTL = 900
+# Summarized /search answers; the TTL depends on how quickly answers to that kind of query go stale.
+SEARCH_ANSWER_CACHE_SIZE = 500
+SEARCH_ANSWER_TTLS = {"fresh": 600, "default": 3600, "reference": 21600}
 
 RANDOM_QUESTION_PROBABILITY = float(os.getenv("RANDOM_QUESTION_PROBABILITY", "0.000000000000001"))
 RANDOM_PARTICIPATION_PROBABILITY = float(os.getenv("RANDOM_PARTICIPATION_PROBABILITY", "0.000000000000001"))
 RANDOM_QUESTIONS = False
 
+# Messages from the same user that arrive within this many seconds are merged into one request (0 disables).
+MESSAGE_DEBOUNCE_SECONDS = 0.0
+# Upper bound for the per-chat setting (the settings page allows the same range).
+MAX_DEBOUNCE_SECONDS = 10.0
+
 IMAGE_GENERATION_ENABLED = True
+
+# Speech-to-text: "whisper" (openai-whisper), "whisper-int8" (dynamically quantized torch, CPU)
+# or "faster-whisper" (CTranslate2, needs the faster-whisper package; STT_COMPUTE_TYPE applies).
+STT_BACKEND = _get_env("STT_BACKEND", "whisper").strip().casefold()
+STT_MODEL_SIZE = _get_env("STT_MODEL_SIZE", "small").strip()
+STT_COMPUTE_TYPE = _get_env("STT_COMPUTE_TYPE", "int8").strip()
+# Device for faster-whisper: "cpu", "cuda" or "auto" (CUDA when available). whisper-int8 always runs on CPU.
+STT_DEVICE = _get_env("STT_DEVICE", "cpu").strip().casefold()
+# After this many voice messages in a row are detected as the same language, later messages
+# in the chat skip language detection. The learned language is kept in memory only and is
+# checked again after STT_LANGUAGE_HINT_USES messages; a different detection drops it.
+# An stt_language chosen in the settings always wins.
+STT_LANGUAGE_CONFIRMATIONS = 3
+STT_LANGUAGE_HINT_USES = 10
+# Audio longer than this is cut at silences into chunks of about this many seconds,
+# transcribed by up to STT_WORKERS processes (each holds its own copy of the model).
+STT_CHUNK_SECONDS = 120
+STT_WORKERS = 2
+
+# Local models loaded (and run once on dummy input) in the background right after startup,
+# comma-separated: "llm" (LangChain imports), "whisper", "tts", "image". Models not listed load on first use.
+# "whisper_workers" also starts the STT_WORKERS long-audio processes, each loading its own copy of the
+# speech model; it is not in the default list because of the memory that takes.
+WARMUP_MODELS = [
+    item.strip().casefold()
+    for item in _get_env("WARMUP_MODELS", "llm,whisper,tts,image").split(",")
+    if item.strip()
+]
+
+# Photos sent to the LLM use the smallest Telegram size whose longer edge reaches this many pixels.
+VISION_MAX_EDGE = 1024
+# Images are re-encoded as JPEG with this quality after downscaling (requires Pillow).
+VISION_JPEG_QUALITY = 85
+# Image token cost estimate: one token per VISION_PATCH_SIZE x VISION_PATCH_SIZE patch plus a fixed overhead.
+VISION_PATCH_SIZE = 28
+VISION_TOKEN_OVERHEAD = 85
+# Descriptions of analyzed photos (keyed by Telegram file_unique_id) kept for follow-up questions.
+PHOTO_DESCRIPTION_CACHE_SIZE = 1000
+# A photo is only described once a later turn in its chat needs it; until then its image is held here.
+UNDESCRIBED_PHOTO_CACHE_SIZE = 64
+UNDESCRIBED_PHOTO_TTL = 3600
+
+ARCHIVE_ENABLED = True
+ARCHIVE_RECALL_LIMIT = 3
+ARCHIVE_RECALL_MIN_SCORE = 2.0
+ARCHIVE_RECALL_MAX_CHARS = 300
+# The archive files keep every message; only the newest ARCHIVE_MEMORY_ENTRIES per chat are held in memory
+# and searchable, for at most ARCHIVE_CACHED_CHATS chats at a time (others are reloaded from disk on use).
+ARCHIVE_MEMORY_ENTRIES = 20000
+ARCHIVE_CACHED_CHATS = 100
+ARCHIVE_CACHE_TTL = 3600
+
+SUMMARY_CHUNK_SIZE = 50
+SUMMARY_MAX_MESSAGES = 2000
+SUMMARY_PARALLELISM = 4
+SUMMARY_REDUCE_MAX_TOKENS = 6000
@@ -1,10 +1,12 @@
 import logging
+import math
 import random
-import os
-import tempfile
 import json
 import asyncio
 import base64
+import re
+import time
+from datetime import datetime
 from io import BytesIO
 
 from telegram import (
@@ -22,33 +24,80 @@ from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
 from app.config import (
+    ARCHIVE_ENABLED,
+    CAPABILITY_PROBE_ON_START,
     CONTEXT_LIMIT_TOKENS,
+    DEEP_SEARCH_ENABLED,
     IMAGE_GENERATION_ENABLED,
+    MAX_CONCURRENT_UPDATES,
+    MAX_DEBOUNCE_SECONDS,
     RANDOM_PARTICIPATION_PROBABILITY,
     RANDOM_QUESTION_PROBABILITY,
-    TOKEN_CHAR_RATIO,
+    SEARCH_CONTEXT_TOKENS,
+    TOOL_CALLING_MODE,
+    TOOL_CALLS_TIMEOUT,
+    MAX_TOOL_CALLS,
+    UNDESCRIBED_PHOTO_CACHE_SIZE,
+    UNDESCRIBED_PHOTO_TTL,
+    VISION_MAX_EDGE,
     WEB_SEARCH_ENABLED,
     WEB_SEARCH_MAX_RESULTS,
 )
+from app.admin_index import filter_admin_chats, forget_chat, is_chat_admin, record_member_status
+from app.archive import append_archive, get_archive_entries, search_archive
+from app.cache import TTLCache
+from app.capabilities import (
+    TOOLS,
+    VISION,
+    is_capability_error,
+    load_capabilities,
+    probe_capabilities,
+    record_capability,
+    supports,
+)
 from app.llm_client import chat_completion
 from app.llm_service import (
+    describe_image,
     generate_random_question,
     process_chat_request,
+    summarize_chat_log,
     summarize_search_results,
     format_transcribed_text,
     summarize_transcription,
 )
 from app.memory_service import update_knowledge_base
-from app.search_client import WebSearchError, search_web
+from app.metrics import increment, observe
+from app.page_fetcher import fetch_pages
+from app.rerank import build_search_context
+from app.search_client import (
+    WebSearchError,
+    cache_answer,
+    close_search_clients,
+    get_cached_answer,
+    search_web,
+)
+from app.send_scheduler import schedule_edit, schedule_send
+from app.intent_router import (
+    AMBIGUOUS as AMBIGUOUS_INTENT,
+    CALCULATE as CALCULATE_INTENT,
+    DATETIME as DATETIME_INTENT,
+    IMAGE as IMAGE_INTENT,
+    SEARCH as SEARCH_INTENT,
+    calculate,
+    route as route_intent,
+)
 from app.image_client import ImageGenerationError, generate_image
-from app.audio_client import transcribe_audio
+from app.audio_client import close_transcription_pool, transcribe_audio
 from app.tts_client import generate_speech
 from app.pipeline import _strip_markdown_syntax
 from app.state import (
+    annotate_history,
     apply_pending_action,
     append_history,
     clear_history,
     clear_pending,
+    get_chat_lock,
+    get_history,
     get_settings,
     get_random_seen_user,
     is_allowed_user,
@@ -59,6 +108,8 @@ from app.state import (
     persist_history,
     persist_knowledge,
     set_pending,
+    get_stt_language_hint,
+    record_detected_language,
     set_raw_transcription,
     get_raw_transcription,
     get_all_known_groups,
@@ -67,12 +118,12 @@ from app.state import (
     append_chat_log,
     get_chat_logs,
     clear_chat_logs,
+    get_photo_description,
+    set_photo_description,
     PERSONAS,
 )
 from app.text_utils import (
-    _estimate_tokens,
     _extract_prompt,
-    _format_search_results,
     _get_command_text,
     _get_reply_text,
     _is_triggered,
@@ -81,6 +132,15 @@ from app.text_utils import (
     detect_transcription_request,
 )
 from app.ui import _cancel_keyboard, _format_settings, _settings_keyboard
+from app.vision import prepare_image
+from app.warmup import (
+    IMAGE as IMAGE_MODEL,
+    TTS as TTS_MODEL,
+    WHISPER as WHISPER_MODEL,
+    ensure_ready,
+    is_ready,
+    start_warmup,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -155,6 +215,20 @@ _FUNCTION_CALLING_TOOLS = [
 
 _SETTINGS_ADMIN_ONLY_TEXT = "Только администратор может менять настройки."
 
+# (chat_id, user_id) -> asyncio.Task generating the latest reply for that user.
+_INFLIGHT_REPLIES = {}
+# (chat_id, user_id) -> prompts collected during the debounce window, plus the timer task that flushes them.
+_PENDING_PROMPTS = {}
+# file_unique_id -> task generating that photo's description; concurrent messages with the same photo await it.
+_DESCRIBING_PHOTOS = {}
+# (chat_id, file_unique_id) -> image of a photo answered in that chat but not described yet.
+_UNDESCRIBED_PHOTOS = TTLCache(UNDESCRIBED_PHOTO_CACHE_SIZE, UNDESCRIBED_PHOTO_TTL)
+_PHOTO_MARKER_RE = re.compile(r"\[Фото ([\w-]+)\]")
+# Replies run outside the update processor, so they take their own slot; per chat they also queue in order.
+_REPLY_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+
+_DEFAULT_PHOTO_PROMPT = "Опиши это изображение"
+
 
 async def _is_group_admin(bot, chat_id, user_id):
     if user_id is None:
@@ -164,11 +238,15 @@ async def _is_group_admin(bot, chat_id, user_id):
     if settings.get("added_by") == user_id:
         return True
         
-    try:
-        member = await bot.get_chat_member(chat_id, user_id)
-    except Exception:
-        return False
-    return member.status in {"administrator", "creator"}
+    return await is_chat_admin(bot, chat_id, user_id)
+
+
+async def _get_admin_group_ids(bot, user_id):
+    """Known groups where the user may change settings; cached statuses avoid per-group API calls."""
+    groups = get_all_known_groups()
+    owned = {gid for gid in groups if get_settings(gid).get("added_by") == user_id}
+    admin = set(await filter_admin_chats(bot, user_id, [gid for gid in groups if gid not in owned]))
+    return [gid for gid in groups if gid in owned or gid in admin]
 
 
 async def _require_settings_admin(update, context):
@@ -203,7 +281,7 @@ async def _ensure_update_allowed(update, context):
     if is_allowed_user(user_id):
         return True
     if update.message:
-        await update.message.reply_text("Доступ ограничен.")
+        await _safe_reply_text(update.message, "Доступ ограничен.")
     return False
 
 
@@ -217,26 +295,36 @@ async def _ensure_query_allowed(query, context):
 
 async def _safe_reply_text(message, text, parse_mode=None, reply_markup=None):
     try:
-        return await message.reply_text(
+        return await schedule_send(message.chat_id, lambda: message.reply_text(
             text, parse_mode=parse_mode, reply_markup=reply_markup
-        )
+        ))
     except BadRequest as exc:
         if parse_mode:
             logger.warning("Markdown parse failed, retrying without parse_mode: %s", exc)
-            return await message.reply_text(text, reply_markup=reply_markup)
+            return await schedule_send(message.chat_id, lambda: message.reply_text(text, reply_markup=reply_markup))
         raise
 
 
-async def _safe_send_message(bot, chat_id, text, parse_mode=None):
+async def _safe_send_message(bot, chat_id, text, parse_mode=None, reply_markup=None):
     try:
-        return await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        return await schedule_send(chat_id, lambda: bot.send_message(
+            chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup
+        ))
     except BadRequest as exc:
         if parse_mode:
             logger.warning("Markdown parse failed, retrying without parse_mode: %s", exc)
-            return await bot.send_message(chat_id=chat_id, text=text)
+            return await schedule_send(chat_id, lambda: bot.send_message(
+                chat_id=chat_id, text=text, reply_markup=reply_markup
+            ))
         raise
 
 
+async def _safe_edit_text(message, text, reply_markup=None):
+    return await schedule_edit(
+        message.chat_id, message.message_id, lambda: message.edit_text(text, reply_markup=reply_markup)
+    )
+
+
 async def _get_user_manageable_chats(bot, user_id, private_chat_id):
     chats = []
     pm_settings = get_settings(private_chat_id)
@@ -245,15 +333,14 @@ async def _get_user_manageable_chats(bot, user_id, private_chat_id):
         "title": "👤 Личные сообщения",
         "settings": pm_settings
     })
-    for gid in get_all_known_groups():
-        if await _is_group_admin(bot, gid, user_id):
-            g_settings = get_settings(gid)
-            title = g_settings.get("chat_title") or f"Группа {gid}"
-            chats.append({
-                "id": gid,
-                "title": f"👥 {title}",
-                "settings": g_settings
-            })
+    for gid in await _get_admin_group_ids(bot, user_id):
+        g_settings = get_settings(gid)
+        title = g_settings.get("chat_title") or f"Группа {gid}"
+        chats.append({
+            "id": gid,
+            "title": f"👥 {title}",
+            "settings": g_settings
+        })
     return chats
 
 async def _get_admin_settings_keyboard(bot, user_id, private_chat_id, current_chat_id):
@@ -263,7 +350,13 @@ async def _get_admin_settings_keyboard(bot, user_id, private_chat_id, current_ch
 async def _generate_and_send_image(message, prompt):
     status_msg = None
     try:
-        status_msg = await _safe_reply_text(message, "⏳ Запрос добавлен в очередь на генерацию. Пожалуйста, подождите...")
+        if not is_ready(IMAGE_MODEL):
+            status_msg = await _safe_reply_text(message, "⏳ Модель генерации изображений загружается, картинка будет готова чуть позже...")
+            if not await ensure_ready(IMAGE_MODEL):
+                raise ImageGenerationError("Модель генерации изображений не загрузилась.")
+            await _safe_edit_text(status_msg, "⏳ Запрос добавлен в очередь на генерацию. Пожалуйста, подождите...")
+        else:
+            status_msg = await _safe_reply_text(message, "⏳ Запрос добавлен в очередь на генерацию. Пожалуйста, подождите...")
         await message.chat.send_action(action=ChatAction.UPLOAD_PHOTO)
         image_bytes = await generate_image(prompt)
         if not image_bytes:
@@ -277,7 +370,7 @@ async def _generate_and_send_image(message, prompt):
             error_msg += " Сервис генерации временно перегружен."
         if status_msg:
             try:
-                await status_msg.edit_text(error_msg)
+                await _safe_edit_text(status_msg, error_msg)
             except Exception:
                 pass
         else:
@@ -286,35 +379,38 @@ async def _generate_and_send_image(message, prompt):
             except Exception:
                 pass
         return False
-    stream = BytesIO(image_bytes)
-    stream.name = "generated.png"
-    stream.seek(0)
+
+    def image_stream():
+        # schedule_send repeats the call after RetryAfter, and every attempt must upload the file from the start.
+        stream = BytesIO(image_bytes)
+        stream.name = "generated.png"
+        return stream
+
     caption = f"Запрос: {prompt}"
     if len(caption) > 180:
         caption = f"Запрос: {prompt[:177]}..."
     
     try:
-        await message.reply_photo(
-            photo=stream,
+        await schedule_send(message.chat_id, lambda: message.reply_photo(
+            photo=image_stream(),
             caption=caption,
             reply_to_message_id=message.message_id,
             read_timeout=60,
             write_timeout=60,
             connect_timeout=60,
-        )
+        ))
     except BadRequest as exc:
         # If Telegram rejects the image payload, retry as a document.
         # This also helps diagnose issues such as an error payload returned as text.
         logger.warning("reply_photo failed (%s), trying reply_document...", exc)
-        stream.seek(0)
-        await message.reply_document(
-            document=stream,
+        await schedule_send(message.chat_id, lambda: message.reply_document(
+            document=image_stream(),
             caption=caption + " (отправлено файлом из-за ошибки обработки)",
             reply_to_message_id=message.message_id,
             read_timeout=60,
             write_timeout=60,
             connect_timeout=60,
-        )
+        ))
 
     if status_msg:
         try:
@@ -333,27 +429,32 @@ async def _execute_search_from_tool(update, context, query):
             "Поиск отключен. Включи WEB_SEARCH_ENABLED=1 в .env."
         )
         return
-    try:
-        await update.message.chat.send_action(action=ChatAction.TYPING)
-        results = await search_web(query, limit=WEB_SEARCH_MAX_RESULTS)
-    except WebSearchError as exc:
-        logger.exception("Web search failed: %s", exc)
-        await _safe_reply_text(update.message, "Не удалось выполнить поиск.")
-        return
-    if not results:
-        await _safe_reply_text(update.message, "Ничего не нашел по этому запросу.")
-        return
-    text = _format_search_results(results, query)
-    
     chat_id = update.effective_chat.id
     settings = get_settings(chat_id)
-    
-    safe_tokens = max(500, CONTEXT_LIMIT_TOKENS - settings.get("max_tokens", 512) - 500)
-    text = _truncate_web_text(text, safe_tokens)
-    
-    await update.message.chat.send_action(action=ChatAction.TYPING)
-    response_text = await summarize_search_results(query, text, settings)
-        
+    max_tokens = settings.get("max_tokens", 512)
+
+    response_text = get_cached_answer(query, max_tokens)
+    if response_text is None:
+        try:
+            await update.message.chat.send_action(action=ChatAction.TYPING)
+            results = await search_web(query, limit=WEB_SEARCH_MAX_RESULTS)
+        except WebSearchError as exc:
+            logger.exception("Web search failed: %s", exc)
+            await _safe_reply_text(update.message, "Не удалось выполнить поиск.")
+            return
+        if not results:
+            await _safe_reply_text(update.message, "Ничего не нашел по этому запросу.")
+            return
+        if DEEP_SEARCH_ENABLED:
+            results = await fetch_pages(results)
+        safe_tokens = max(500, CONTEXT_LIMIT_TOKENS - max_tokens - 500)
+        text = await asyncio.to_thread(build_search_context, query, results, min(SEARCH_CONTEXT_TOKENS, safe_tokens))
+
+        await update.message.chat.send_action(action=ChatAction.TYPING)
+        response_text = await summarize_search_results(query, text, settings)
+        # Only real summaries are cached; the raw-results fallback is retried next time.
+        cache_answer(query, max_tokens, response_text)
+
     if not response_text:
         response_text = text
         
@@ -368,17 +469,6 @@ async def _execute_search_from_tool(update, context, query):
 
 
 
-def _truncate_web_text(text, max_tokens):
-    if not text or _estimate_tokens(text) <= max_tokens:
-        return text
-    char_limit = max_tokens * TOKEN_CHAR_RATIO
-    truncated = text[:char_limit]
-    cut_at = max(truncated.rfind("\n"), truncated.rfind(" "))
-    if cut_at > char_limit // 2:
-        truncated = truncated[:cut_at]
-    return truncated.strip() + "\n\n... [results truncated due to context limit]"
-
-
 async def start_command(update, context):
     if not await _ensure_update_allowed(update, context):
         return
@@ -422,6 +512,7 @@ async def help_command(update, context):
         "/settings — открыть настройки\n"
         "/reset — очистить контекст\n"
         "/search <запрос> — поиск в интернете\n"
+        "/recall <запрос> — поиск по архиву переписки\n"
         "/image <описание> — генерация картинки\n"
         "/setmood <текст> — задать настроение\n"
         "/setprompt <текст> — доп. системный промпт\n"
@@ -441,7 +532,7 @@ async def search_command(update, context):
         return
     query = _get_command_text(update.message.text)
     if not query:
-        await update.message.reply_text("Укажи запрос: /search <текст>")
+        await _safe_reply_text(update.message, "Укажи запрос: /search <текст>")
         return
     if not WEB_SEARCH_ENABLED:
         await _safe_reply_text(
@@ -622,7 +713,10 @@ async def summary_command(update, context):
     if not await _ensure_update_allowed(update, context):
         return
     chat_id = update.effective_chat.id
-    logs = get_chat_logs(chat_id)
+    if ARCHIVE_ENABLED:
+        logs = [entry for entry in await get_archive_entries(chat_id) if entry.get("role") == "user"]
+    else:
+        logs = get_chat_logs(chat_id)
     if not logs or len(logs) < 3:
         await _safe_reply_text(
             update.message,
@@ -631,28 +725,9 @@ async def summary_command(update, context):
         return
 
     await update.message.chat.send_action(action=ChatAction.TYPING)
-    
-    dialogue = ""
-    for log in logs:
-        dialogue += f"{log['sender']}: {log['text']}\n"
-
-    system_prompt = (
-        "You are an expert secretary assistant. Your task is to write a structured, clear, and concise summary "
-        "of the conversation logs provided. Highlight main topics discussed, what key points each user made, "
-        "and any decisions or action items. Keep the tone professional but warm. Do not add intro/outro greetings. "
-        "Write in Russian."
-    )
-    user_prompt = f"Here are the recent chat messages:\n{dialogue}"
 
     try:
-        response = await chat_completion(
-            [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=1024,
-            temperature=0.4
-        )
+        response = await summarize_chat_log(chat_id, logs)
         if response:
             msg = f"📋 *Выжимка последних обсуждений в чате:*\n\n{response.strip()}"
             await _safe_reply_text(update.message, msg, parse_mode="Markdown")
@@ -663,6 +738,35 @@ async def summary_command(update, context):
         await _safe_reply_text(update.message, "Произошла ошибка при генерации саммари.")
 
 
+async def recall_command(update, context):
+    if not await _ensure_update_allowed(update, context):
+        return
+    if not ARCHIVE_ENABLED:
+        await _safe_reply_text(update.message, "Архив переписки отключен.")
+        return
+    query = _get_command_text(update.message.text)
+    if not query:
+        await _safe_reply_text(update.message, "Укажи запрос: /recall <текст>")
+        return
+    chat_id = update.effective_chat.id
+    hits = await search_archive(chat_id, query, limit=5)
+    if not hits:
+        await _safe_reply_text(update.message, "В архиве чата ничего не нашлось.")
+        return
+
+    lines = [f"🗂 Найдено в архиве по запросу «{query}»:"]
+    for entry, _ in hits:
+        stamp = datetime.fromtimestamp(entry.get("ts", 0)).strftime("%d.%m.%Y %H:%M")
+        text = entry.get("text", "")
+        if len(text) > 500:
+            text = f"{text[:497]}..."
+        lines.append(f"\n[{stamp}] {entry.get('sender') or 'Игрок'}:\n{text}")
+    chunks = _split_message("\n".join(lines))
+    await _safe_reply_text(update.message, chunks[0])
+    for chunk in chunks[1:]:
+        await _safe_send_message(context.bot, chat_id, chunk)
+
+
 async def persona_command(update, context):
     if not await _ensure_update_allowed(update, context):
         return
@@ -948,11 +1052,10 @@ async def settings_button(update, context: ContextTypes.DEFAULT_TYPE):
     if data == "list_groups":
         await query.edit_message_text("⏳ Ищу группы, в которых вы администратор...")
         admin_groups = []
-        for gid in get_all_known_groups():
-            if await _is_group_admin(context.bot, gid, user_id):
-                g_settings = get_settings(gid)
-                title = g_settings.get("chat_title") or str(gid)
-                admin_groups.append((gid, title))
+        for gid in await _get_admin_group_ids(context.bot, user_id):
+            g_settings = get_settings(gid)
+            title = g_settings.get("chat_title") or str(gid)
+            admin_groups.append((gid, title))
         
         if not admin_groups:
             await query.edit_message_text("Вы не являетесь администратором ни в одной известной мне группе.")
@@ -975,10 +1078,11 @@ async def settings_button(update, context: ContextTypes.DEFAULT_TYPE):
         
         await query.message.delete()
         keyboard = await _get_admin_settings_keyboard(context.bot, user_id, chat_id, target_id)
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"✅ Выбран чат: {display_name}\n\n{_format_settings(settings)}",
-            reply_markup=keyboard
+        await _safe_send_message(
+            context.bot,
+            chat_id,
+            f"✅ Выбран чат: {display_name}\n\n{_format_settings(settings)}",
+            reply_markup=keyboard,
         )
         return
     if data == "toggle_voice":
@@ -1028,11 +1132,7 @@ async def settings_button(update, context: ContextTypes.DEFAULT_TYPE):
             "set_trigger": "Введи новое слово-триггер.",
         }
         text_prompt = prompts.get(data, "Введи значение.") + "\n\n(Для отмены напиши «отмена»)"
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=text_prompt,
-            reply_markup=ForceReply(),
-        )
+        await _safe_send_message(context.bot, chat_id, text_prompt, reply_markup=ForceReply())
         return
     if data == "show_raw_transcription":
         raw_text = get_raw_transcription(chat_id)
@@ -1094,6 +1194,17 @@ async def web_app_data_handler(update, context: ContextTypes.DEFAULT_TYPE):
             settings["random_question_prob"] = float(payload.get("random_question_prob", RANDOM_QUESTION_PROBABILITY))
         if "random_participation_prob" in payload:
             settings["random_participation_prob"] = float(payload.get("random_participation_prob", RANDOM_PARTICIPATION_PROBABILITY))
+        if "debounce_seconds" in payload:
+            debounce = float(payload.get("debounce_seconds") or 0)
+            if not math.isfinite(debounce):
+                raise ValueError(f"debounce_seconds must be finite, got {debounce}")
+            settings["debounce_seconds"] = min(max(debounce, 0.0), MAX_DEBOUNCE_SECONDS)
+        if "stt_language" in payload:
+            # Empty means "detect the language of voice messages" (and learn it while it stays the same).
+            stt_language = (payload.get("stt_language") or "").strip().casefold()
+            if stt_language and not re.fullmatch(r"[a-z]{2,3}", stt_language):
+                raise ValueError(f"stt_language must be a language code, got {stt_language!r}")
+            settings["stt_language"] = stt_language
             
         await persist_settings()
         
@@ -1113,12 +1224,16 @@ async def web_app_data_handler(update, context: ContextTypes.DEFAULT_TYPE):
 
 async def post_init(application):
     await load_persisted_chat_settings()
+    await load_capabilities()
+    if CAPABILITY_PROBE_ON_START:
+        asyncio.create_task(probe_capabilities())
+    start_warmup()
     
     base_commands = [
         BotCommand("reset", "Сбросить контекст диалога"),
         BotCommand("resetkb", "Сбросить базу знаний (память)"),
         BotCommand("memory", "Показать сохраненную память (KB)"),
-        BotCommand("summary", "Сделать выжимку последних 50 сообщений"),
+        BotCommand("summary", "Сделать выжимку обсуждений в чате"),
         BotCommand("persona", "Сменить характер (персону) бота"),
         BotCommand("truth", "Правда (игра «Правда или Действие»)"),
         BotCommand("dare", "Действие (игра «Правда или Действие»)"),
@@ -1126,6 +1241,7 @@ async def post_init(application):
         BotCommand("image", "Сгенерировать картинку"),
         BotCommand("help", "Краткая справка"),
         BotCommand("search", "Поиск в интернете"),
+        BotCommand("recall", "Найти старые сообщения в архиве чата"),
     ]
     
     admin_commands = [
@@ -1143,6 +1259,11 @@ async def post_init(application):
         logger.warning("Failed to set bot commands: %s", exc)
 
 
+async def post_shutdown(application):
+    await close_search_clients()
+    close_transcription_pool()
+
+
 async def chat_member_handler(update, context: ContextTypes.DEFAULT_TYPE):
     """Track bot additions to groups so the initial settings owner can be assigned."""
     result = update.my_chat_member
@@ -1164,60 +1285,44 @@ async def chat_member_handler(update, context: ContextTypes.DEFAULT_TYPE):
         
         await persist_settings()
         logger.info("Bot added to group %s by user %s", chat_id, user_id)
+    elif new_status in {"left", "kicked"}:
+        # Without chat_member updates from this chat the cached admin rights would only go stale.
+        forget_chat(result.chat.id)
 
 
-_TOOL_KEYWORDS = {
-    # Image related
-    "нарисуй", "картинк", "изображен", "рисун", "сгенерир", "напиши портрет", "draw", "paint", "picture", "image", "photo", "illustrat",
-    # Search related
-    "найди", "поиск", "погугл", "интернет", "новости", "search", "google", "find", "узнай", "последн", "свеж", "погод", "weather",
-    "кто такой", "что такое", "что за", "news", "latest", "info", "справк", "информаци", "сведения",
-    # Math related
-    "посчитай", "вычисли", "сколько будет", "умножить", "разделить", "сложить", "вычесть", "корень", "calculate", "math", "evaluate", "plus", "minus",
-    # Datetime related
-    "время", "дата", "число", "какой сегодня день", "какой год", "time", "date", "today", "year"
-}
+async def member_status_handler(update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the admin index current when members are promoted, demoted or leave."""
+    result = update.chat_member
+    if not result:
+        return
+    record_member_status(result.chat.id, result.new_chat_member.user.id, result.new_chat_member.status)
 
 
-def _might_need_tools(prompt: str) -> bool:
-    if not prompt:
-        return False
-    prompt_lower = prompt.casefold()
-    for kw in _TOOL_KEYWORDS:
-        if kw in prompt_lower:
-            return True
-    if len(prompt) > 80:
-        return True
-    return False
+def _pick_photo_size(photo_sizes):
+    """Smallest Telegram thumbnail that is still large enough for the vision model."""
+    for size in sorted(photo_sizes, key=lambda item: item.width * item.height):
+        if max(size.width, size.height) >= VISION_MAX_EDGE:
+            return size
+    return max(photo_sizes, key=lambda item: item.width * item.height)
 
 
-def _safe_eval_math(expression: str) -> str:
-    cleaned = expression.strip()
-    if not cleaned:
-        return "Empty expression"
-    if len(cleaned) > 100:
-        return "Expression too long"
-    import re
-    if not re.match(r'^[a-zA-Z0-9+\-*/().\s]*$', cleaned):
-        return "Invalid characters in expression."
-    allowed_words = {"math", "sqrt", "sin", "cos", "tan", "log", "pi", "e", "pow", "abs"}
-    words = re.findall(r'[a-zA-Z]+', cleaned)
-    for word in words:
-        if word not in allowed_words:
-            return f"Security error: word '{word}' is not allowed in expression."
-    try:
-        import math
-        safe_dict = {
-            "abs": abs,
-            "round": round,
-            "min": min,
-            "max": max,
-            "math": math,
-        }
-        result = eval(cleaned, {"__builtins__": {}}, safe_dict)
-        return str(result)
-    except Exception as e:
-        return f"Error evaluating expression: {e}"
+async def _download_photo(bot, photo_sizes):
+    size = _pick_photo_size(photo_sizes)
+    photo_file = await bot.get_file(size.file_id)
+    # Use BytesIO to avoid saving to disk
+    buf = BytesIO()
+    await photo_file.download_to_memory(buf)
+    increment("media_downloads_photo")
+    increment("media_download_bytes", buf.tell())
+    started = time.perf_counter()
+    image_bytes = await asyncio.to_thread(prepare_image, buf.getvalue())
+    observe("vision_preprocess", time.perf_counter() - started)
+    increment("vision_payload_bytes", len(image_bytes))
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+
+# Partial transcripts in the status message keep only their end, well inside Telegram's 4096-character limit.
+_TRANSCRIPT_PREVIEW_CHARS = 3500
 
 
 async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
@@ -1225,27 +1330,15 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     audio_obj = update.message.voice or update.message.audio or update.message.video_note
-    photo_obj = update.message.photo[-1] if update.message.photo else None
+    # Photos are only downloaded once the message turns out to be addressed to the bot.
+    photo_sizes = tuple(update.message.photo or ())
     text = update.message.text or update.message.caption or ""
 
-    if not text and not audio_obj and not photo_obj:
+    if not text and not audio_obj and not photo_sizes:
         return
-
-    image_data = None
-    if photo_obj:
-        if not await _ensure_update_allowed(update, context):
-            return
-        await update.message.chat.send_action(action=ChatAction.UPLOAD_PHOTO)
-        try:
-            photo_file = await context.bot.get_file(photo_obj.file_id)
-            # Use BytesIO to avoid saving to disk
-            buf = BytesIO()
-            await photo_file.download_to_memory(buf)
-            image_data = base64.b64encode(buf.getvalue()).decode("utf-8")
-        except Exception as exc:
-            logger.exception("Photo processing failed: %s", exc)
-            await _safe_reply_text(update.message, "Ошибка обработки изображения.")
-            return
+    increment("messages_handled")
+    # Archive entries and recall both use this time to tell which messages the prompt already covers.
+    received_at = time.time()
 
     if audio_obj:
         is_private = update.effective_chat.type == ChatType.PRIVATE
@@ -1259,30 +1352,46 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.chat.send_action(action=ChatAction.TYPING)
         try:
             voice_file = await context.bot.get_file(audio_obj.file_id)
-            with tempfile.NamedTemporaryFile(suffix=".tmp", delete=False) as temp_audio:
-                temp_path = temp_audio.name
-            
-            try:
-                await voice_file.download_to_drive(temp_path)
-                status_msg = await _safe_reply_text(update.message, "⏳ Распознаю аудио...")
-                
-                transcribed_text = await transcribe_audio(temp_path)
-                if not transcribed_text:
-                    await status_msg.edit_text("❌ Не удалось распознать аудио.")
+            # Bot API downloads are capped at 20 MB, so the audio is kept in memory rather than on disk.
+            audio_bytes = bytes(await voice_file.download_as_bytearray())
+            increment("media_downloads_audio")
+            increment("media_download_bytes", len(audio_bytes))
+            if not is_ready(WHISPER_MODEL):
+                status_msg = await _safe_reply_text(update.message, "⏳ Модель распознавания речи загружается, подожди немного...")
+                if not await ensure_ready(WHISPER_MODEL):
+                    await _safe_edit_text(status_msg, "❌ Не удалось распознать аудио.")
                     return
-            finally:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+                await _safe_edit_text(status_msg, "⏳ Распознаю аудио...")
+            else:
+                status_msg = await _safe_reply_text(update.message, "⏳ Распознаю аудио...")
 
-            set_raw_transcription(update.effective_chat.id, transcribed_text)
+            async def report_progress(done, total, partial_text):
+                status = f"⏳ Распознаю аудио... {done}/{total}"
+                if partial_text:
+                    if len(partial_text) > _TRANSCRIPT_PREVIEW_CHARS:
+                        partial_text = "…" + partial_text[-_TRANSCRIPT_PREVIEW_CHARS:]
+                    status += f"\n\n{partial_text}"
+                await _safe_edit_text(status_msg, status)
 
-            await status_msg.edit_text("⏳ Улучшаю читаемость текста...")
             settings = get_settings(update.effective_chat.id)
+            language_hint = get_stt_language_hint(update.effective_chat.id)
+            transcribed_text, language = await transcribe_audio(
+                audio_bytes, language=language_hint, on_progress=report_progress
+            )
+            if not transcribed_text:
+                await _safe_edit_text(status_msg, "❌ Не удалось распознать аудио.")
+                return
+
+            set_raw_transcription(update.effective_chat.id, transcribed_text)
+            if not language_hint:
+                record_detected_language(update.effective_chat.id, language)
+
+            await _safe_edit_text(status_msg, "⏳ Улучшаю читаемость текста...")
             formatted_text = await format_transcribed_text(transcribed_text, settings)
 
             summary_text = ""
             if duration > 120:
-                await status_msg.edit_text("⏳ Формирую выжимку (summary)...")
+                await _safe_edit_text(status_msg, "⏳ Формирую выжимку (summary)...")
                 summary_text = await summarize_transcription(formatted_text, settings)
 
             if text:
@@ -1296,7 +1405,7 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
             chunks = _split_message(out_text)
             keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Показать оригинал", callback_data="show_raw_transcription")]])
             
-            await status_msg.edit_text(chunks[0], reply_markup=keyboard if len(chunks) == 1 else None)
+            await _safe_edit_text(status_msg, chunks[0], reply_markup=keyboard if len(chunks) == 1 else None)
             for i, chunk in enumerate(chunks[1:], start=1):
                 is_last = (i == len(chunks) - 1)
                 await _safe_reply_text(update.message, chunk, reply_markup=keyboard if is_last else None)
@@ -1318,6 +1427,8 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
             if user.username:
                 sender_name = f"{sender_name} (@{user.username})"
             asyncio.create_task(append_chat_log(chat_id, sender_name, text))
+            if ARCHIVE_ENABLED:
+                asyncio.create_task(append_archive(chat_id, sender_name, text, ts=received_at))
         
     settings = get_settings(chat_id)
     if update.effective_chat.type in {ChatType.GROUP, ChatType.SUPERGROUP} and update.effective_chat.title:
@@ -1374,9 +1485,9 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
         prompt = reply_text
         reply_text = ""
     if not prompt:
-        if image_data:
+        if photo_sizes:
             # If there's an image but no text, provide a default prompt
-            prompt = "Опиши это изображение"
+            prompt = _DEFAULT_PHOTO_PROMPT
         else:
             if update.effective_chat.type == ChatType.PRIVATE:
                 await _safe_reply_text(update.message, "Пожалуйста, введи текст запроса.")
@@ -1387,6 +1498,264 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
                 )
             return
 
+    _queue_reply(update, context, settings, prompt, reply_text, photo_sizes, received_at)
+
+
+def _queue_reply(update, context, settings, prompt, reply_text, photo_sizes, received_at):
+    """Start the reply now, or hold it for the chat's debounce window to merge follow-up messages."""
+    window = min(float(settings.get("debounce_seconds") or 0), MAX_DEBOUNCE_SECONDS)
+    if not window > 0:
+        _start_reply(update, context, settings, prompt, reply_text, photo_sizes, received_at)
+        return
+    user_id = update.effective_user.id if update.effective_user else None
+    key = (update.effective_chat.id, user_id)
+    pending = _PENDING_PROMPTS.get(key)
+    if pending is None:
+        pending = {"prompts": [], "reply_text": "", "photo_sizes": (), "received_at": received_at}
+        _PENDING_PROMPTS[key] = pending
+    else:
+        pending["timer"].cancel()
+        increment("messages_coalesced")
+    pending["prompts"].append(prompt)
+    pending["update"] = update
+    pending["reply_text"] = pending["reply_text"] or reply_text
+    if photo_sizes:
+        pending["photo_sizes"] = photo_sizes
+    pending["timer"] = asyncio.create_task(_flush_pending_prompt(key, context, settings, window))
+
+
+async def _flush_pending_prompt(key, context, settings, window):
+    await asyncio.sleep(window)
+    pending = _PENDING_PROMPTS.pop(key, None)
+    if pending is None:
+        return
+    # Reply to the latest message of the burst with all of its parts as one prompt.
+    prompt = "\n".join(pending["prompts"])
+    _start_reply(
+        pending["update"], context, settings, prompt, pending["reply_text"], pending["photo_sizes"],
+        pending["received_at"],
+    )
+
+
+def _start_reply(update, context, settings, prompt, reply_text, photo_sizes, received_at):
+    """Run the reply in the background, superseding an unfinished reply to the same user in this chat."""
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id if update.effective_user else None
+    key = (chat_id, user_id)
+    previous = _INFLIGHT_REPLIES.get(key)
+    if previous is not None and not previous.done():
+        # Cancelling the task also aborts the in-flight HTTP request, so the backend frees its slot.
+        previous.cancel()
+        increment("replies_cancelled")
+        logger.info("Cancelled outdated reply for user %s in chat %s", user_id, chat_id)
+    increment("replies_started")
+    _INFLIGHT_REPLIES[key] = asyncio.create_task(
+        _run_reply(key, update, context, settings, prompt, reply_text, photo_sizes, received_at)
+    )
+
+
+async def _run_reply(key, update, context, settings, prompt, reply_text, photo_sizes, received_at):
+    try:
+        # The chat lock is FIFO, so replies in one chat keep message order; a superseded reply
+        # is cancelled while it waits and never starts.
+        async with get_chat_lock(key[0], "reply"):
+            async with _REPLY_SLOTS:
+                await _answer_prompt(update, context, settings, prompt, reply_text, photo_sizes, received_at)
+    except Exception as exc:
+        logger.exception("Reply processing failed: %s", exc)
+    finally:
+        if _INFLIGHT_REPLIES.get(key) is asyncio.current_task():
+            del _INFLIGHT_REPLIES[key]
+
+
+async def _describe_photo(photo_id, image_data):
+    # Always the neutral describe-only prompt: the chat reply is in the persona's voice, not a description.
+    description = await describe_image(image_data)
+    if description:
+        await set_photo_description(photo_id, description)
+    return description
+
+
+def _forget_describing(photo_id, task):
+    if _DESCRIBING_PHOTOS.get(photo_id) is task:
+        del _DESCRIBING_PHOTOS[photo_id]
+
+
+async def _remember_photo(chat_id, photo_id, image_data, marker):
+    """Replace the photo's history placeholder with its description, generating it once per photo."""
+    try:
+        task = _DESCRIBING_PHOTOS.get(photo_id)
+        if task is None:
+            task = asyncio.create_task(_describe_photo(photo_id, image_data))
+            _DESCRIBING_PHOTOS[photo_id] = task
+            task.add_done_callback(lambda done: _forget_describing(photo_id, done))
+        description = await asyncio.shield(task)
+        if _annotate_all(chat_id, marker, f"[Фото: {description}]" if description else "[Фото]"):
+            await persist_history()
+    except Exception as exc:
+        logger.warning("Failed to store photo description: %s", exc)
+
+
+def _annotate_all(chat_id, marker, text):
+    changed = False
+    while annotate_history(chat_id, marker, text):
+        changed = True
+    return changed
+
+
+async def _describe_earlier_photos(chat_id, current_photo_id):
+    """
+    Describe the photos whose placeholders are still in the chat history, now that a
+    later turn is about to send that history to a text-only request. A photo answered
+    once and never followed up costs no extra vision request.
+    """
+    photo_ids = set()
+    for entry in get_history(chat_id):
+        content = entry.get("content")
+        if isinstance(content, str):
+            photo_ids.update(_PHOTO_MARKER_RE.findall(content))
+    # The photo attached to this turn is sent to the model itself and stays pending.
+    photo_ids.discard(current_photo_id)
+    tasks = []
+    forgotten = False
+    for photo_id in photo_ids:
+        marker = f"[Фото {photo_id}]"
+        image_data = _UNDESCRIBED_PHOTOS.pop((chat_id, photo_id))
+        if image_data:
+            tasks.append(_remember_photo(chat_id, photo_id, image_data, marker))
+        else:
+            # Expired or lost on restart: leave a neutral mark instead of an opaque id.
+            forgotten = _annotate_all(chat_id, marker, "[Фото]") or forgotten
+    if tasks:
+        increment("photo_descriptions_deferred", len(tasks))
+        await asyncio.gather(*tasks)
+    if forgotten:
+        await persist_history()
+
+
+_TOOL_TAG_RE = re.compile(r"\[(GENERATE_IMAGE|SEARCH_WEB|CALCULATE):\s*([^\]]*)\]|\[(CURRENT_DATETIME)\]")
+_TOOL_TAGS = {
+    "GENERATE_IMAGE": ("generate_image", "prompt"),
+    "SEARCH_WEB": ("search_web", "query"),
+    "CALCULATE": ("calculate", "expression"),
+}
+
+
+async def _route_with_llm(prompt, available_tools):
+    """Ask the LLM which tools to use; returns a list of (function_name, args)."""
+    # We use a specialized system prompt for weak models to trigger tools via text if JSON fails.
+    fallback_system = (
+        "You are a routing assistant. If the user wants an image, reply ONLY with [GENERATE_IMAGE: descriptive prompt]. "
+        "If the user wants a web search, reply ONLY with [SEARCH_WEB: search query]. "
+        "If the user wants to calculate a math expression, reply ONLY with [CALCULATE: python math expression]. "
+        "If the user wants to know the current date or time, reply ONLY with [CURRENT_DATETIME]. "
+        "If several of these are needed, reply with one tag per line. "
+        "Otherwise, reply with 'NORMAL'."
+    )
+    tool_messages = [
+        {"role": "system", "content": fallback_system},
+        {"role": "user", "content": prompt}
+    ]
+
+    # Standard tool calling first, unless this model is already known not to support it
+    native_tools = supports(TOOLS) is not False
+    if native_tools:
+        try:
+            response_text, tool_calls = await chat_completion(
+                tool_messages,
+                tools=available_tools,
+                tool_choice="auto",
+                temperature=0.1,
+                max_tokens=100
+            )
+            await record_capability(TOOLS, True)
+        except Exception as exc:
+            logger.warning("Native tool calling failed, falling back to text routing: %s", exc)
+            if is_capability_error(exc, TOOLS):
+                await record_capability(TOOLS, False)
+            native_tools = False
+    if not native_tools:
+        response_text = await chat_completion(
+            tool_messages,
+            temperature=0.1,
+            max_tokens=100
+        )
+        tool_calls = []
+
+    # Process standard tool calls
+    if tool_calls:
+        return [(tool_call.get("name"), tool_call.get("args") or {}) for tool_call in tool_calls]
+
+    # Fallback for weak models: Check text response for [TAGS]
+    calls = []
+    for match in _TOOL_TAG_RE.finditer(response_text or ""):
+        if match.group(3):
+            calls.append(("current_datetime", {}))
+        else:
+            function_name, arg_name = _TOOL_TAGS[match.group(1)]
+            calls.append((function_name, {arg_name: match.group(2).strip()}))
+    return calls
+
+
+async def _search_results_text(query, max_tokens):
+    """Formatted web search results for the reply, empty on failure."""
+    try:
+        results = await search_web(query, limit=WEB_SEARCH_MAX_RESULTS)
+    except Exception as exc:
+        logger.warning("Web search failed: %s", exc)
+        return ""
+    if not results:
+        return ""
+    if DEEP_SEARCH_ENABLED:
+        results = await fetch_pages(results)
+    return await asyncio.to_thread(build_search_context, query, results, max_tokens)
+
+
+async def _run_tools(update, settings, prompt, calls):
+    """
+    Run search, calculation and clock tool calls together; returns merged
+    (web_context, web_results_text). Searches run concurrently within
+    TOOL_CALLS_TIMEOUT, the rest is computed inline.
+    """
+    contexts = []
+    queries = []
+    for function_name, function_args in calls[:MAX_TOOL_CALLS]:
+        if function_name == "search_web" and WEB_SEARCH_ENABLED:
+            queries.append(function_args.get("query") or prompt)
+        elif function_name == "calculate":
+            expression = function_args.get("expression", "")
+            # Always computed here: the model's own arguments never supply the answer.
+            result = calculate(expression)
+            if result is None:
+                contexts.append(f"Calculation failed: {expression} is not a valid or bounded expression")
+            else:
+                contexts.append(f"Calculation result: {expression} = {result}")
+        elif function_name == "current_datetime":
+            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            contexts.append(f"Current server date and time: {now_str}")
+
+    web_results_text = ""
+    queries = list(dict.fromkeys(queries))
+    if queries:
+        await update.message.chat.send_action(action=ChatAction.TYPING)
+        safe_tokens = max(500, CONTEXT_LIMIT_TOKENS - settings.get("max_tokens", 512) - 1000)
+        per_query = max(250, min(SEARCH_CONTEXT_TOKENS, safe_tokens // len(queries)))
+        tasks = [asyncio.create_task(_search_results_text(query, per_query)) for query in queries]
+        done, pending = await asyncio.wait(tasks, timeout=TOOL_CALLS_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            increment("tool_calls_timed_out", len(pending))
+            logger.warning("%d of %d searches did not finish in %ss", len(pending), len(tasks), TOOL_CALLS_TIMEOUT)
+        web_results_text = "\n\n".join(task.result() for task in tasks if task in done and task.result())
+        if web_results_text:
+            contexts.append(f"Data from the internet (excerpts):\n{web_results_text}")
+    return "\n\n".join(contexts), web_results_text
+
+
+async def _answer_prompt(update, context, settings, prompt, reply_text, photo_sizes, received_at):
+    chat_id = update.effective_chat.id
+    trigger_word = settings["trigger_word"]
     web_context = ""
     web_results_text = ""
     
@@ -1397,102 +1766,45 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
         if tool["function"]["name"] == "search_web" and not WEB_SEARCH_ENABLED:
             continue
         available_tools.append(tool)
-        
-    if available_tools and prompt and _might_need_tools(prompt):
-        try:
-            # We use a specialized system prompt for weak models to trigger tools via text if JSON fails.
-            fallback_system = (
-                "You are a routing assistant. If the user wants an image, reply ONLY with [GENERATE_IMAGE: descriptive prompt]. "
-                "If the user wants a web search, reply ONLY with [SEARCH_WEB: search query]. "
-                "If the user wants to calculate a math expression, reply ONLY with [CALCULATE: python math expression]. "
-                "If the user wants to know the current date or time, reply ONLY with [CURRENT_DATETIME]. "
-                "Otherwise, reply with 'NORMAL'."
-            )
-            tool_messages = [
-                {"role": "system", "content": fallback_system},
-                {"role": "user", "content": prompt}
-            ]
-            
-            # First attempt with standard tool calling (if model supports it)
+
+    tool_calls = []
+    reply_tools = None
+    if available_tools and prompt:
+        # Clear-cut intents are resolved locally; only ambiguous prompts pay for an LLM routing call.
+        intent = route_intent(prompt)
+        increment(f"intent_{intent.name}")
+        if intent.name == IMAGE_INTENT:
+            tool_calls = [("generate_image", {"prompt": intent.argument})]
+        elif intent.name == SEARCH_INTENT:
+            tool_calls = [("search_web", {"query": intent.argument})]
+        elif intent.name == CALCULATE_INTENT:
+            tool_calls = [("calculate", {"expression": intent.argument[0]})]
+        elif intent.name == DATETIME_INTENT:
+            tool_calls = [("current_datetime", {})]
+        elif intent.name == AMBIGUOUS_INTENT and TOOL_CALLING_MODE == "single_pass":
+            # The reply request itself carries the tool schemas, saving the routing round-trip.
+            reply_tools = available_tools
+        elif intent.name == AMBIGUOUS_INTENT:
             try:
-                response_text, tool_calls = await chat_completion(
-                    tool_messages,
-                    tools=available_tools,
-                    tool_choice="auto",
-                    temperature=0.1,
-                    max_tokens=100
-                )
+                tool_calls = await _route_with_llm(prompt, available_tools)
             except Exception as exc:
-                logger.warning("Native tool calling failed, falling back to text routing: %s", exc)
-                response_text = await chat_completion(
-                    tool_messages,
-                    temperature=0.1,
-                    max_tokens=100
-                )
-                tool_calls = []
-            
-            # Process standard tool calls
-            if tool_calls:
-                tool_call = tool_calls[0]
-                function_name = tool_call.get("name")
-                function_args = tool_call.get("args", {})
-                
-                if function_name == "generate_image" and IMAGE_GENERATION_ENABLED:
-                    asyncio.create_task(_generate_and_send_image(update.message, function_args.get("prompt", prompt)))
-                    return
-                elif function_name == "search_web" and WEB_SEARCH_ENABLED:
-                    search_query = function_args.get("query", prompt)
-                    # Proceed to actual search logic below...
-                    await update.message.chat.send_action(action=ChatAction.TYPING)
-                    try:
-                        results = await search_web(search_query, limit=WEB_SEARCH_MAX_RESULTS)
-                        if results:
-                            web_results_text = _format_search_results(results, search_query)
-                            safe_tokens = max(500, CONTEXT_LIMIT_TOKENS - settings.get("max_tokens", 512) - 1000)
-                            web_results_text = _truncate_web_text(web_results_text, safe_tokens)
-                            web_context = (
-                                "Data from the internet (excerpts):\n"
-                                f"{web_results_text}"
-                            )
-                    except WebSearchError as exc:
-                        logger.warning("Web search failed: %s", exc)
-                elif function_name == "calculate":
-                    expression = function_args.get("expression", "")
-                    result = _safe_eval_math(expression)
-                    web_context = f"Calculation result: {expression} = {result}"
-                elif function_name == "current_datetime":
-                    from datetime import datetime
-                    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    web_context = f"Current server date and time: {now_str}"
-
-            # Fallback for weak models: Check text response for [TAGS]
-            elif response_text:
-                if "[GENERATE_IMAGE:" in response_text and IMAGE_GENERATION_ENABLED:
-                    img_prompt = response_text.split("[GENERATE_IMAGE:")[1].split("]")[0].strip()
-                    asyncio.create_task(_generate_and_send_image(update.message, img_prompt or prompt))
-                    return
-                elif "[SEARCH_WEB:" in response_text and WEB_SEARCH_ENABLED:
-                    search_query = response_text.split("[SEARCH_WEB:")[1].split("]")[0].strip()
-                    await update.message.chat.send_action(action=ChatAction.TYPING)
-                    try:
-                        results = await search_web(search_query or prompt, limit=WEB_SEARCH_MAX_RESULTS)
-                        if results:
-                            web_results_text = _format_search_results(results, search_query or prompt)
-                            safe_tokens = max(500, CONTEXT_LIMIT_TOKENS - settings.get("max_tokens", 512) - 1000)
-                            web_results_text = _truncate_web_text(web_results_text, safe_tokens)
-                            web_context = f"Data from the internet:\n{web_results_text}"
-                    except Exception:
-                        pass
-                elif "[CALCULATE:" in response_text:
-                    expression = response_text.split("[CALCULATE:")[1].split("]")[0].strip()
-                    result = _safe_eval_math(expression)
-                    web_context = f"Calculation result: {expression} = {result}"
-                elif "[CURRENT_DATETIME]" in response_text:
-                    from datetime import datetime
-                    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    web_context = f"Current server date and time: {now_str}"
-        except Exception as exc:
-            logger.warning("Tool routing failed: %s", exc)
+                logger.warning("Tool routing failed: %s", exc)
+
+    image_calls = [args for name, args in tool_calls if name == "generate_image"]
+    if image_calls and IMAGE_GENERATION_ENABLED:
+        for args in image_calls:
+            asyncio.create_task(_generate_and_send_image(update.message, args.get("prompt") or prompt))
+        if len(image_calls) == len(tool_calls):
+            return
+    if tool_calls:
+        web_context, web_results_text = await _run_tools(update, settings, prompt, tool_calls)
+
+    async def execute_tool(name, args):
+        if name == "generate_image" and IMAGE_GENERATION_ENABLED:
+            asyncio.create_task(_generate_and_send_image(update.message, args.get("prompt") or prompt))
+            return "The image is being generated and will be sent as a separate message. Say so in one short sentence."
+        tool_context, _ = await _run_tools(update, settings, prompt, [(name, args)])
+        return tool_context
 
     reset_used, reset_remainder = _split_reset_request(prompt)
     if reset_used:
@@ -1504,6 +1816,40 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
         prompt = reset_remainder
         reply_text = ""
 
+    image_data = None
+    image_note = ""
+    photo_id = ""
+    from_reply = False
+    replied = update.message.reply_to_message
+    if not photo_sizes and replied and replied.photo:
+        photo_sizes = tuple(replied.photo)
+        from_reply = True
+    if photo_sizes and supports(VISION) is False:
+        # Text-only model: the photo would be dropped from the request anyway.
+        photo_sizes = ()
+    if photo_sizes:
+        # Every size of one photo shares the identity of the largest one; re-sent photos keep it too.
+        photo_id = photo_sizes[-1].file_unique_id
+        description = get_photo_description(photo_id)
+        if description:
+            # Known photo: answer from its stored description without another vision request.
+            increment("photo_description_hits")
+            photo_id = ""
+            if from_reply:
+                reply_text = f"{reply_text}\n[Фото: {description}]".strip()
+            else:
+                prompt = f"{prompt}\n[Фото: {description}]"
+        else:
+            await update.message.chat.send_action(action=ChatAction.UPLOAD_PHOTO)
+            try:
+                image_data = await _download_photo(context.bot, photo_sizes)
+            except Exception as exc:
+                logger.exception("Photo processing failed: %s", exc)
+                await _safe_reply_text(update.message, "Ошибка обработки изображения.")
+                return
+            image_note = f"[Фото {photo_id}]"
+
+    await _describe_earlier_photos(chat_id, photo_id)
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
     # Tell the model its current display name so self-references match the configured identity.
@@ -1516,7 +1862,10 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
     req_settings["extra_prompt"] = f"{req_settings.get('extra_prompt', '')}{gender_hint}".strip()
 
     response_text, parse_mode, error_msg = await process_chat_request(
-        chat_id, prompt, reply_text, req_settings, web_context, web_results_text, image_data=image_data
+        chat_id, prompt, reply_text, req_settings, web_context, web_results_text,
+        image_data=image_data, image_note=image_note,
+        tools=reply_tools, tool_executor=execute_tool if reply_tools else None,
+        received_at=received_at,
     )
     
     if error_msg:
@@ -1529,6 +1878,10 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
             {"role": "user", "content": prompt},
             {"role": "assistant", "content": response_text}
         ]))
+        if ARCHIVE_ENABLED:
+            asyncio.create_task(append_archive(chat_id, context.bot.first_name or "Bot", response_text, role="assistant"))
+        if photo_id:
+            _UNDESCRIBED_PHOTOS.set((chat_id, photo_id), image_data)
 
     chunks = _split_message(response_text)
     if not chunks:
@@ -1553,14 +1906,16 @@ async def handle_message(update, context: ContextTypes.DEFAULT_TYPE):
                 clean_text = snippet[:cut_at] + "..." if cut_at > 0 else snippet + "..."
                 
         voice_setting = settings.get("voice_response")
-        audio_bytes = await generate_speech(clean_text, voice=voice_setting)
+        audio_bytes = b""
+        if await ensure_ready(TTS_MODEL):
+            audio_bytes = await generate_speech(clean_text, voice=voice_setting)
         if audio_bytes:
             try:
-                await context.bot.send_voice(
+                await schedule_send(chat_id, lambda: context.bot.send_voice(
                     chat_id=chat_id,
                     voice=audio_bytes,
                     reply_to_message_id=update.message.message_id
-                )
+                ))
                 voice_sent = True
             except Exception as exc:
                 logger.warning("Failed to send voice response: %s", exc)
@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import gc
+import threading
 from io import BytesIO
 
 from app.llm_client import chat_completion
@@ -13,6 +14,7 @@ class ImageGenerationError(RuntimeError):
 
 
 _pipeline = None
+_pipeline_lock = threading.Lock()
 _generation_lock = None
 
 def _get_lock():
@@ -21,53 +23,66 @@ def _get_lock():
         _generation_lock = asyncio.Lock()
     return _generation_lock
 
+def _load_pipeline():
+    try:
+        import torch
+        from diffusers import DiffusionPipeline, EulerAncestralDiscreteScheduler
+
+        logger.info("Loading local DreamShaper pipeline...")
+
+        device = "cpu"
+        dtype = torch.float32
+
+        if torch.cuda.is_available():
+            device = "cuda"
+            dtype = torch.float16
+        elif torch.backends.mps.is_available():
+            device = "mps"
+            dtype = torch.float32
+
+        pipeline = DiffusionPipeline.from_pretrained(
+            "segmind/tiny-sd",
+            torch_dtype=dtype,
+            safety_checker=None
+        )
+
+        pipeline.scheduler = EulerAncestralDiscreteScheduler.from_config(pipeline.scheduler.config)
+
+        if device == "cuda":
+            try:
+                pipeline.enable_xformers_memory_efficient_attention()
+                logger.info("Enabled xformers acceleration for image generation")
+            except Exception:
+                logger.info("xformers acceleration is unavailable (recommended for CUDA: pip install xformers)")
+
+        pipeline = pipeline.to(device)
+
+        logger.info("DreamShaper pipeline loaded on %s", device)
+    except ImportError as exc:
+        raise ImageGenerationError(
+            "Image generation dependencies are missing. "
+            "Install them with: pip install diffusers transformers torch accelerate"
+        ) from exc
+    except Exception as exc:
+        logger.error("Failed to initialize the image pipeline: %s", exc)
+        raise ImageGenerationError(f"Model loading failed: {exc}")
+    return pipeline
+
+
 def _get_pipeline():
     global _pipeline
     if _pipeline is None:
-        try:
-            import torch
-            from diffusers import DiffusionPipeline, EulerAncestralDiscreteScheduler
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = _load_pipeline()
+    return _pipeline
 
-            logger.info("Loading local DreamShaper pipeline...")
-            
-            device = "cpu"
-            dtype = torch.float32
-            
-            if torch.cuda.is_available():
-                device = "cuda"
-                dtype = torch.float16
-            elif torch.backends.mps.is_available():
-                device = "mps"
-                dtype = torch.float32
-
-            _pipeline = DiffusionPipeline.from_pretrained(
-                "segmind/tiny-sd",
-                torch_dtype=dtype,
-                safety_checker=None
-            )
-
-            _pipeline.scheduler = EulerAncestralDiscreteScheduler.from_config(_pipeline.scheduler.config)
-
-            if device == "cuda":
-                try:
-                    _pipeline.enable_xformers_memory_efficient_attention()
-                    logger.info("Enabled xformers acceleration for image generation")
-                except Exception:
-                    logger.info("xformers acceleration is unavailable (recommended for CUDA: pip install xformers)")
-
-            _pipeline = _pipeline.to(device)
-
-            logger.info("DreamShaper pipeline loaded on %s", device)
-        except ImportError as exc:
-            raise ImageGenerationError(
-                "Image generation dependencies are missing. "
-                "Install them with: pip install diffusers transformers torch accelerate"
-            ) from exc
-        except Exception as exc:
-            logger.error("Failed to initialize the image pipeline: %s", exc)
-            raise ImageGenerationError(f"Model loading failed: {exc}")
 
-    return _pipeline
+def warm_up():
+    """Load the pipeline and run a single tiny denoising step."""
+    pipe = _get_pipeline()
+    pipe(prompt="warm-up", num_inference_steps=1, height=64, width=64)
+    gc.collect()
 
 
 def _generate_sync(prompt: str) -> bytes:
@@ -0,0 +1,452 @@
+import ast
+import math
+import operator
+import re
+import zlib
+from collections import namedtuple
+
+from app.bm25 import tokenize
+from app.config import INTENT_CONFIDENCE
+
+IMAGE = "image"
+SEARCH = "search"
+CALCULATE = "calculate"
+DATETIME = "datetime"
+NONE = "none"
+# The local router is not sure; the LLM router decides.
+AMBIGUOUS = "ambiguous"
+
+LABELS = (IMAGE, SEARCH, CALCULATE, DATETIME, NONE)
+
+Intent = namedtuple("Intent", "name confidence argument")
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: finds every registered phrase in one pass over the text."""
+
+    def __init__(self, phrases):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for phrase, label in phrases:
+            self._add(phrase.casefold(), label)
+        self._build_links()
+
+    def _add(self, phrase, label):
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = next_state
+        self._output[state].add(label)
+
+    def _build_links(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find(self, text):
+        labels = set()
+        state = 0
+        for char in text.casefold():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            labels |= self._output[state]
+        return labels
+
+
+# Phrases that almost always mean the user wants the tool.
+_KEYWORDS = {
+    IMAGE: [
+        "нарисуй", "нарисовать", "сгенерируй картинк", "сгенерируй изображен", "создай картинк",
+        "создай изображен", "сделай картинк", "сделай арт", "изобрази", "draw ", "generate an image",
+        "generate a picture", "create an image", "paint me",
+    ],
+    SEARCH: [
+        "найди в интернете", "поищи в интернете", "найди в сети", "погугли", "загугли", "поищи",
+        "что пишут", "последние новости", "свежие новости", "новости про", "новости о", "прогноз погоды",
+        "погода в", "курс доллара", "курс евро", "search the web", "google it", "look up", "latest news",
+        "weather in",
+    ],
+    DATETIME: [
+        "который час", "сколько времени", "какое сегодня число", "какой сегодня день", "какая сегодня дата",
+        "какой сейчас год", "какой сегодня день недели", "what time is it", "what's the date",
+        "what day is it", "today's date", "current time",
+    ],
+    CALCULATE: [
+        "посчитай", "вычисли", "сколько будет", "calculate", "compute",
+    ],
+}
+
+_AUTOMATON = KeywordAutomaton((phrase, label) for label, phrases in _KEYWORDS.items() for phrase in phrases)
+
+# Seed examples the linear model is trained on at import time.
+_TRAINING_DATA = {
+    IMAGE: [
+        "нарисуй кота в шляпе",
+        "нарисуй мне закат над морем",
+        "сгенерируй картинку с драконом",
+        "создай изображение космического корабля",
+        "сделай арт в стиле аниме",
+        "изобрази робота, играющего на гитаре",
+        "можешь нарисовать портрет рыцаря",
+        "хочу картинку с котиками",
+        "draw a cat wearing sunglasses",
+        "draw me a castle on a hill",
+        "draw a knight riding a horse",
+        "generate an image of a cyberpunk city",
+        "make a picture of a dog on the moon",
+        "paint me a watercolor landscape",
+    ],
+    SEARCH: [
+        "найди в интернете рецепт борща",
+        "погугли кто выиграл матч вчера",
+        "какие последние новости про spacex",
+        "какая погода в москве завтра",
+        "поищи отзывы о новом айфоне",
+        "что пишут про выборы",
+        "курс доллара на сегодня",
+        "когда выйдет новый сезон сериала",
+        "кто сейчас президент франции",
+        "сколько стоит биткоин сейчас",
+        "search the web for python 3.13 release notes",
+        "what is the weather in london",
+        "latest news about openai",
+        "look up the population of canada",
+        "who won the champions league this year",
+    ],
+    CALCULATE: [
+        "посчитай 15 процентов от 2400",
+        "сколько будет 128 умножить на 46",
+        "вычисли корень из 144",
+        "сколько будет 2 в степени 10",
+        "раздели 1000 на 7",
+        "сложи 345 и 678",
+        "calculate 17 * 23",
+        "what is 15% of 80",
+        "compute the square root of 2",
+        "how much is 250 divided by 4",
+    ],
+    DATETIME: [
+        "который час",
+        "сколько сейчас времени",
+        "какое сегодня число",
+        "какой сегодня день недели",
+        "какой сейчас год",
+        "какая сегодня дата",
+        "what time is it",
+        "what is the date today",
+        "what day of the week is it",
+        "current time please",
+    ],
+    NONE: [
+        "привет, как дела?",
+        "расскажи анекдот",
+        "что ты думаешь о смысле жизни",
+        "мне грустно сегодня",
+        "как тебя зовут",
+        "спасибо, ты лучший",
+        "объясни, что такое рекурсия",
+        "что такое любовь",
+        "напиши стихотворение про осень",
+        "помоги придумать название для кота",
+        "как приготовить омлет",
+        "ты согласен со мной?",
+        "расскажи о себе",
+        "почему небо голубое",
+        "дай совет, как лучше учить английский",
+        "переведи на английский: доброе утро",
+        "сколько тебе лет",
+        "какой твой любимый фильм",
+        "hello there",
+        "tell me a joke",
+        "what do you think about cats",
+        "explain how a hash map works",
+        "write a short poem about the sea",
+        "i had a bad day",
+        "thanks for the info",
+        "расскажи историю про пирата, чтобы было смешно",
+        "придумай тост на день рождения друга",
+        "напиши письмо начальнику с просьбой об отпуске",
+        "как думаешь, стоит ли мне менять работу",
+        "объясни простыми словами теорию относительности",
+        "давай поиграем в слова",
+        "составь план тренировок на неделю",
+        "can you help me write a cover letter",
+        "summarize the idea of stoicism in a few sentences",
+        # Tool keywords used in another sense.
+        "объясни, как нарисовать диаграмму в excel",
+        "как научиться рисовать? с чего начать",
+        "почему мой код не рисует график в pyplot",
+        "поищи в себе силы простить его",
+        "опиши погоду в рассказе чехова",
+        "как погода в книге отражает настроение героя",
+        "курс лекций по истории посоветуй",
+        "let's draw a line under this discussion",
+        "what can we draw from these results",
+        "i really look up to my older brother",
+        "how do i draw a plot with matplotlib",
+        "the news in the book was shocking to the hero",
+    ],
+}
+
+_FEATURE_BITS = 12
+_FEATURE_DIM = 1 << _FEATURE_BITS
+_EPOCHS = 40
+_LEARNING_RATE = 0.5
+_L2 = 1e-4
+
+
+def _feature(name):
+    return zlib.crc32(name.encode("utf-8")) & (_FEATURE_DIM - 1)
+
+
+def _features(text, keyword_labels):
+    tokens = tokenize(text)
+    names = ["bias"]
+    names.extend(f"w={token}" for token in tokens)
+    names.extend(f"b={left}_{right}" for left, right in zip(tokens, tokens[1:]))
+    names.extend(f"kw={label}" for label in keyword_labels)
+    if re.search(r"\d", text):
+        names.append("has_digit")
+    if re.search(r"\d\s*[-+*/^%]\s*\d", text):
+        names.append("has_operator")
+    weights = {}
+    for name in names:
+        index = _feature(name)
+        weights[index] = weights.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in weights.values()))
+    return {index: value / norm for index, value in weights.items()}
+
+
+def _softmax(scores):
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+class HashedLinearClassifier:
+    """Multinomial logistic regression over hashed sparse features, trained with SGD."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.weights = [[0.0] * _FEATURE_DIM for _ in labels]
+
+    def predict_proba(self, features):
+        scores = [sum(row[index] * value for index, value in features.items()) for row in self.weights]
+        return dict(zip(self.labels, _softmax(scores)))
+
+    def fit(self, samples):
+        for epoch in range(_EPOCHS):
+            rate = _LEARNING_RATE / (1 + epoch * 0.1)
+            for features, label in samples:
+                probs = self.predict_proba(features)
+                for row_index, row_label in enumerate(self.labels):
+                    error = probs[row_label] - (1.0 if row_label == label else 0.0)
+                    row = self.weights[row_index]
+                    for index, value in features.items():
+                        row[index] -= rate * (error * value + _L2 * row[index])
+        return self
+
+
+def _train():
+    samples = []
+    for label, texts in _TRAINING_DATA.items():
+        for text in texts:
+            samples.append((_features(text, _AUTOMATON.find(text)), label))
+    # Interleave classes so SGD does not see long runs of one label.
+    samples.sort(key=lambda sample: zlib.crc32(repr(sorted(sample[0].items())).encode("utf-8")))
+    return HashedLinearClassifier(LABELS).fit(samples)
+
+
+_MODEL = _train()
+
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+# Names the LLM may use in a calculate tool call, bare or as math.<name>.
+_FUNCTIONS = {
+    "sqrt": math.sqrt, "sin": math.sin, "cos": math.cos, "tan": math.tan, "log": math.log,
+    "abs": abs, "round": round, "min": min, "max": max,
+}
+_CONSTANTS = {"pi": math.pi, "e": math.e}
+_MAX_EXPONENT = 100
+# Bound on integer results (about 300 digits): big-int powers and products grow without limit
+# and would block the event loop, and str() refuses ints over 4300 digits anyway.
+_MAX_RESULT_BITS = 1024
+
+_ARITHMETIC_PREFIX_RE = re.compile(
+    r"^(?:сколько будет|посчитай|вычисли|реши|calculate|compute|what is|what's|how much is)\s*",
+    re.IGNORECASE,
+)
+_ARITHMETIC_RE = re.compile(r"^[\d\s.,+\-*/×÷^%()]+$")
+# "1,000,000": commas grouping thousands, as opposed to the decimal comma in "2,5".
+_THOUSANDS_RE = re.compile(r"(?<![\d.,])[1-9]\d{0,2}(?:,\d{3})+(?![\d.,])")
+# Without "сколько будет" in front these are ranges, dates and phone numbers, not sums:
+# "2024-2025", "8-800-555-35-35", "12/05/2024".
+_NOT_ARITHMETIC_RE = re.compile(r"^\d+(?:-\d+)+$|^\d+(?:/\d+){2,}$")
+
+
+def _check_operands(op, left, right):
+    if isinstance(op, ast.Pow):
+        if abs(right) > _MAX_EXPONENT:
+            raise ValueError("exponent too large")
+        if isinstance(left, int) and isinstance(right, int) and (abs(left).bit_length() - 1) * right > _MAX_RESULT_BITS:
+            raise ValueError("result too large")
+    elif isinstance(op, ast.Mult) and isinstance(left, int) and isinstance(right, int):
+        if abs(left).bit_length() + abs(right).bit_length() > _MAX_RESULT_BITS + 1:
+            raise ValueError("result too large")
+
+
+def _check_result(value):
+    if isinstance(value, complex):
+        raise ValueError("complex result")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise OverflowError("result too large")
+    if isinstance(value, int) and value.bit_length() > _MAX_RESULT_BITS:
+        raise ValueError("result too large")
+    return value
+
+
+def _evaluate_node(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return _check_result(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        left = _evaluate_node(node.left)
+        right = _evaluate_node(node.right)
+        _check_operands(node.op, left, right)
+        return _check_result(_BINARY_OPERATORS[type(node.op)](left, right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](_evaluate_node(node.operand))
+    name = _math_name(node)
+    if name in _CONSTANTS:
+        return _CONSTANTS[name]
+    if isinstance(node, ast.Call) and not node.keywords and 0 < len(node.args) <= 2:
+        name = _math_name(node.func)
+        args = [_evaluate_node(arg) for arg in node.args]
+        if name == "pow" and len(args) == 2:
+            _check_operands(ast.Pow(), *args)
+            return _check_result(operator.pow(*args))
+        if name == "round" and len(args) == 2 and abs(args[1]) > 15:
+            # round(x, -10**9) on an int builds 10**(10**9) first.
+            raise ValueError("too many digits")
+        if name in _FUNCTIONS:
+            return _check_result(_FUNCTIONS[name](*args))
+    raise ValueError("unsupported expression")
+
+
+def _math_name(node):
+    """"sqrt" for both `sqrt` and `math.sqrt`; None for anything else."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "math":
+        return node.attr
+    return None
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.10g}"
+    return str(value)
+
+
+def evaluate_arithmetic(text):
+    """Evaluate a plain arithmetic question ("сколько будет 2+2*2?"); returns (expression, result) or None."""
+    stripped = text.strip()
+    expression = _ARITHMETIC_PREFIX_RE.sub("", stripped).rstrip(" ?=!").strip()
+    if not expression or len(expression) > 100 or not _ARITHMETIC_RE.match(expression):
+        return None
+    if not re.search(r"\d\s*[-+*/×÷^%]\s*[\d(]", expression) and not expression.startswith(("-", "(")):
+        return None
+    has_prefix = len(expression) < len(stripped.rstrip(" ?=!"))
+    if not has_prefix and _NOT_ARITHMETIC_RE.match(expression):
+        return None
+    normalized = _THOUSANDS_RE.sub(lambda match: match.group(0).replace(",", ""), expression)
+    normalized = normalized.replace("×", "*").replace("÷", "/").replace("^", "**").replace(",", ".")
+    try:
+        result = _evaluate_node(ast.parse(normalized, mode="eval"))
+        return expression, _format_number(result)
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError, TypeError):
+        return None
+
+
+def calculate(expression):
+    """
+    Evaluate a calculate tool expression: plain arithmetic as people write it,
+    or a Python-style one with math functions ("math.sqrt(2) * pi").
+    Returns the formatted result, or None when it is invalid or too large.
+    """
+    arithmetic = evaluate_arithmetic(expression)
+    if arithmetic:
+        return arithmetic[1]
+    expression = expression.strip()
+    if not expression or len(expression) > 100:
+        return None
+    try:
+        result = _evaluate_node(ast.parse(expression.replace("^", "**"), mode="eval"))
+        return _format_number(result)
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError, TypeError):
+        return None
+
+
+_SEARCH_PREFIX_RE = re.compile(
+    r"^(?:пожалуйста\s+)?(?:найди в интернете|поищи в интернете|найди в сети|погугли|загугли|поищи|найди|"
+    r"search the web for|search for|google|look up)\s*[,:]?\s*",
+    re.IGNORECASE,
+)
+_IMAGE_PREFIX_RE = re.compile(
+    r"^(?:пожалуйста\s+)?(?:нарисуй(?: мне)?|сгенерируй|создай|сделай|изобрази|draw|paint(?: me)?|generate|create)\s*",
+    re.IGNORECASE,
+)
+
+
+def route(prompt):
+    """Classify a prompt locally. Returns an Intent; AMBIGUOUS means the LLM router should decide."""
+    text = (prompt or "").strip()
+    if not text:
+        return Intent(NONE, 1.0, "")
+
+    arithmetic = evaluate_arithmetic(text)
+    if arithmetic:
+        return Intent(CALCULATE, 1.0, arithmetic)
+
+    keyword_labels = _AUTOMATON.find(text)
+    probs = _MODEL.predict_proba(_features(text, keyword_labels))
+    label = max(probs, key=probs.get)
+    confidence = probs[label]
+    # Keywords are only features: "draw conclusions" or "look up to" must not skip the LLM on their own.
+    if confidence < INTENT_CONFIDENCE or label == CALCULATE:
+        # Math in words ("процент от зарплаты") still needs the LLM to write the expression.
+        return Intent(AMBIGUOUS, confidence, "")
+    if label == SEARCH:
+        return Intent(SEARCH, confidence, _SEARCH_PREFIX_RE.sub("", text) or text)
+    if label == IMAGE:
+        return Intent(IMAGE, confidence, _IMAGE_PREFIX_RE.sub("", text) or text)
+    return Intent(label, confidence, "")
@@ -1,8 +1,6 @@
+import importlib
 import logging
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-
 from app.config import (
     MAX_TOKENS,
     OPENAI_API_KEY,
@@ -23,7 +21,16 @@ class LLMRequestError(RuntimeError):
         self.detail = detail
 
 
+def warm_up():
+    """Import LangChain ahead of the first request; it takes about a second."""
+    importlib.import_module("langchain_core.messages")
+    importlib.import_module("langchain_openai")
+
+
 def _to_lc_messages(messages):
+    # LangChain is imported on first use so it does not slow down bot startup.
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
     converted = []
     for message in messages or []:
         role = message.get("role", "user")
@@ -32,13 +39,17 @@ def _to_lc_messages(messages):
         if role == "system":
             converted.append(SystemMessage(content=content))
         elif role == "assistant":
-            converted.append(AIMessage(content=content))
+            converted.append(AIMessage(content=content, tool_calls=message.get("tool_calls") or []))
+        elif role == "tool":
+            converted.append(ToolMessage(content=content, tool_call_id=message.get("tool_call_id", "")))
         else:
             converted.append(HumanMessage(content=content))
     return converted
 
 
 def _build_llm(model, max_tokens, temperature):
+    from langchain_openai import ChatOpenAI
+
     kwargs = {
         "base_url": OPENAI_BASE_URL,
         "api_key": OPENAI_API_KEY,
@@ -1,5 +1,20 @@
+import asyncio
+import hashlib
 import logging
+import zlib
 
+from app.archive import recall_relevant_turns
+from app.capabilities import TOOLS, VISION, is_capability_error, record_capability, supports
+from app.config import (
+    ARCHIVE_ENABLED,
+    MAX_TOOL_CALLS,
+    SUMMARY_CHUNK_SIZE,
+    SUMMARY_MAX_MESSAGES,
+    SUMMARY_PARALLELISM,
+    SUMMARY_REDUCE_MAX_TOKENS,
+    TOKEN_CHAR_RATIO,
+    TOOL_CALLS_TIMEOUT,
+)
 from app.llm_client import LLMRequestError, chat_completion
 from app.pipeline import (
     _build_flat_fallback_messages,
@@ -8,16 +23,21 @@ from app.pipeline import (
     _context_limit_exceeded,
     _is_context_overflow_error,
     _is_message_header_error,
+    _max_prompt_tokens,
     _postprocess_response,
     _trim_history_to_fit,
 )
 from app.state import (
     append_history,
+    get_chat_lock,
     get_history,
     get_knowledge,
+    get_summary_cache,
+    persist_summaries,
     set_history,
     trim_oldest_history,
 )
+from app.text_utils import _estimate_messages_tokens, _estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -93,6 +113,144 @@ async def summarize_search_results(query, text, settings):
         return ""
 
 
+_CHAT_SUMMARY_PROMPT = (
+    "You are an expert secretary assistant. Your task is to write a structured, clear, and concise summary "
+    "of the conversation logs provided. Highlight main topics discussed, what key points each user made, "
+    "and any decisions or action items. Keep the tone professional but warm. Do not add intro/outro greetings. "
+    "Write in Russian."
+)
+
+_CHUNK_SUMMARY_PROMPT = (
+    "Summarize this fragment of a group chat log as compact notes. "
+    "Keep the topics discussed, the key points each participant made (with their names), "
+    "and any decisions or action items. Do not add greetings or commentary. Write in Russian."
+)
+
+
+def _format_dialogue(entries):
+    return "".join(f"{entry.get('sender')}: {entry.get('text')}\n" for entry in entries)
+
+
+def _digest(parts):
+    hasher = hashlib.sha1()
+    for part in parts:
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+async def _summarize_text(system_prompt, user_prompt):
+    try:
+        response_text = await chat_completion(
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=1024,
+            temperature=0.4,
+        )
+        return (response_text or "").strip()
+    except Exception as exc:
+        logger.error("Failed to summarize chat fragment: %s", exc)
+        return ""
+
+
+async def _reduce_summaries(summaries):
+    # Collapse neighbouring partial summaries until they fit into one final request.
+    while len(summaries) > 1 and sum(_estimate_tokens(item) for item in summaries) > SUMMARY_REDUCE_MAX_TOKENS:
+        groups = [summaries[idx:idx + 4] for idx in range(0, len(summaries), 4)]
+        reduced = await asyncio.gather(*(
+            _summarize_text(_CHUNK_SUMMARY_PROMPT, "\n\n".join(group)) for group in groups
+        ))
+        summaries = [item for item in reduced if item]
+    if not summaries:
+        return ""
+    parts = "\n\n".join(f"Part {idx}:\n{item}" for idx, item in enumerate(summaries, 1))
+    return await _summarize_text(
+        _CHAT_SUMMARY_PROMPT,
+        f"Here are summaries of consecutive parts of the chat, in chronological order:\n{parts}",
+    )
+
+
+def _chunk_bounds(entries):
+    """
+    Split entries into chunks of about SUMMARY_CHUNK_SIZE whose boundaries depend on the
+    messages themselves, not on their positions: a chunk ends after a message whose hash
+    hits a fixed residue (once the chunk has SUMMARY_CHUNK_SIZE // 2 messages), or at
+    twice the size. Dropping or filtering messages at the front only changes the chunks
+    up to the next boundary, so the rest keep their cached summaries.
+    """
+    min_size = max(1, SUMMARY_CHUNK_SIZE // 2)
+    bounds = []
+    begin = 0
+    for position, entry in enumerate(entries):
+        size = position + 1 - begin
+        marker = zlib.crc32(f"{entry.get('sender')}\0{entry.get('text')}".encode("utf-8"))
+        if (size >= min_size and marker % min_size == 0) or size >= 2 * SUMMARY_CHUNK_SIZE:
+            bounds.append((begin, position + 1))
+            begin = position + 1
+    if begin < len(entries):
+        bounds.append((begin, len(entries)))
+    return bounds
+
+
+async def summarize_chat_log(chat_id, entries):
+    """
+    Map-reduce summary over an append-only list of chat log entries.
+    Chunk summaries are cached by content, so repeated calls only summarize
+    the chunks that received new messages.
+    """
+    if not entries:
+        return ""
+    async with get_chat_lock(chat_id, "summary"):
+        return await _summarize_chat_log(chat_id, entries)
+
+
+async def _summarize_chat_log(chat_id, entries):
+    window_start = max(0, len(entries) - SUMMARY_MAX_MESSAGES)
+    bounds = _chunk_bounds(entries)
+    # Start the window at a chunk boundary so cached chunks keep matching as the log grows.
+    bounds = [bound for bound in bounds if bound[0] >= window_start] or bounds[-1:]
+    if len(bounds) == 1 and bounds[0][1] - bounds[0][0] <= SUMMARY_CHUNK_SIZE:
+        return await _summarize_text(
+            _CHAT_SUMMARY_PROMPT,
+            f"Here are the recent chat messages:\n{_format_dialogue(entries[bounds[0][0]:])}",
+        )
+
+    cache = get_summary_cache(chat_id)
+    chunk_cache = cache["chunks"]
+    semaphore = asyncio.Semaphore(SUMMARY_PARALLELISM)
+
+    async def summarize_chunk(begin, end):
+        dialogue = _format_dialogue(entries[begin:end])
+        digest = _digest([dialogue])
+        cached = chunk_cache.get(digest)
+        if cached and cached.get("summary"):
+            return digest, cached["summary"]
+        async with semaphore:
+            summary = await _summarize_text(_CHUNK_SUMMARY_PROMPT, f"Chat fragment:\n{dialogue}")
+        return digest, summary
+
+    results = await asyncio.gather(*(summarize_chunk(begin, end) for begin, end in bounds))
+    # Keep only the chunks of the current window; this also drops entries in the old offset-keyed format.
+    chunk_cache.clear()
+    for digest, summary in results:
+        if summary:
+            chunk_cache[digest] = {"summary": summary}
+    summaries = [summary for _, summary in results if summary]
+
+    digest = _digest(summaries)
+    final = cache["final"]
+    if final.get("hash") != digest or not final.get("summary"):
+        summary = await _reduce_summaries(summaries)
+        if summary:
+            cache["final"] = {"hash": digest, "summary": summary}
+    else:
+        summary = final["summary"]
+    await persist_summaries()
+    return summary
+
+
 async def generate_random_question(target_user, settings):
     name_mention = f"@{target_user['username']}" if target_user.get("username") else target_user.get("first_name", "user")
     system_prompt = _compose_system_prompt(settings)
@@ -116,9 +274,127 @@ async def generate_random_question(target_user, settings):
         return ""
 
 
-async def process_chat_request(chat_id, prompt, reply_text, settings, web_context="", web_results_text="", image_data=None):
+async def describe_image(image_data):
+    """Short factual description of a photo, kept in history in place of the image itself."""
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "Describe the image factually for someone who cannot see it: objects, people, colors, "
+                "any visible text, and the setting. Up to 120 words, no interpretation or commentary."
+            ),
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Describe this image."},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}},
+            ],
+        },
+    ]
+    try:
+        description = await chat_completion(messages, max_tokens=300, temperature=0.2)
+        return (description or "").strip()
+    except Exception as exc:
+        logger.warning("Failed to describe image: %s", exc)
+        return ""
+
+
+async def process_chat_request(
+    chat_id,
+    prompt,
+    reply_text,
+    settings,
+    web_context="",
+    web_results_text="",
+    image_data=None,
+    image_note="",
+    tools=None,
+    tool_executor=None,
+    received_at=None,
+):
+    """
+    `image_note` is appended to the prompt stored in history, since the image itself is not kept.
+    With `tools`, the reply request offers them to the model; a tool call is run through
+    `await tool_executor(name, args) -> str` and its result is sent back in a follow-up request.
+    `received_at` (time.time() when the message arrived) keeps archive recall from repeating it.
+    """
+    # Replies in one chat read, trim and extend the same history, so they are generated one at a time.
+    async with get_chat_lock(chat_id):
+        return await _process_chat_request(
+            chat_id, prompt, reply_text, settings, web_context, web_results_text, image_data, image_note,
+            tools, tool_executor, received_at,
+        )
+
+
+def _tool_call_messages(tool_calls, results):
+    calls = []
+    replies = []
+    for index, (tool_call, result) in enumerate(zip(tool_calls, results)):
+        call_id = tool_call.get("id") or f"call_{index}"
+        calls.append({"id": call_id, "name": tool_call.get("name", ""), "args": tool_call.get("args") or {}})
+        replies.append({"role": "tool", "tool_call_id": call_id, "content": result})
+    return [{"role": "assistant", "content": "", "tool_calls": calls}] + replies
+
+
+def _clip_to_tokens(text, max_tokens):
+    if _estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(0, max_tokens) * TOKEN_CHAR_RATIO].rstrip() + "\n... [truncated]"
+
+
+def _tool_results_context(web_context, tool_messages):
+    """`web_context` plus the tool results, for the fallback prompts that cannot carry tool messages."""
+    results = [
+        message["content"]
+        for message in tool_messages
+        if message["role"] == "tool" and message["content"] != "No result."
+    ]
+    return "\n\n".join(filter(None, [web_context] + results))
+
+
+async def _run_tool_calls(tool_calls, tool_executor, messages, settings):
+    """
+    Execute the model's tool calls concurrently within TOOL_CALLS_TIMEOUT; returns the
+    messages reporting them back and the raw results (empty for failed or skipped calls).
+    """
+    async def execute(tool_call):
+        try:
+            return await tool_executor(tool_call.get("name", ""), tool_call.get("args") or {}) or ""
+        except Exception as exc:
+            logger.warning("Tool %s failed: %s", tool_call.get("name"), exc)
+            return ""
+
+    tasks = [asyncio.create_task(execute(tool_call)) for tool_call in tool_calls[:MAX_TOOL_CALLS]]
+    done, pending = await asyncio.wait(tasks, timeout=TOOL_CALLS_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("%d of %d tool calls did not finish in %ss", len(pending), len(tasks), TOOL_CALLS_TIMEOUT)
+    # Every call needs an answer in the conversation, including the ones over the limit.
+    results = [task.result() if task in done else "" for task in tasks]
+    results += [""] * (len(tool_calls) - len(tasks))
+    # Results must fit next to the conversation that is already in the request.
+    budget = _max_prompt_tokens(settings["max_tokens"]) - _estimate_messages_tokens(messages) - 50 * len(results)
+    per_result = max(100, budget // max(1, len(results)))
+    clipped = [_clip_to_tokens(result, per_result) if result else "No result." for result in results]
+    return _tool_call_messages(tool_calls, clipped), results
+
+
+async def _process_chat_request(
+    chat_id, prompt, reply_text, settings, web_context, web_results_text, image_data, image_note, tools, tool_executor,
+    received_at,
+):
+    if image_data and supports(VISION) is False:
+        image_data = None
+    # "offer": the model may call a tool; "answer": tool results are in, tools are declared but not callable.
+    tool_phase = "offer" if tools and tool_executor and supports(TOOLS) is not False else None
     history = list(get_history(chat_id))
     knowledge = get_knowledge(chat_id)
+    if ARCHIVE_ENABLED:
+        recalled = await recall_relevant_turns(chat_id, prompt, history, received_at)
+        if recalled:
+            knowledge = f"{knowledge}\n\n{recalled}".strip()
     
     history, trimmed, messages = await _trim_history_to_fit(
         history, prompt, reply_text, settings, web_context, knowledge, image_data=image_data
@@ -131,41 +407,71 @@ async def process_chat_request(chat_id, prompt, reply_text, settings, web_contex
     attempts = 0
     max_attempts = max(1, len(history) // 2 + 1)
     response_text = ""
+    # Tool calls and results of the "offer" phase; kept whenever the messages are rebuilt.
+    tool_messages = []
     
     while True:
         try:
-            response_text = await chat_completion(
-                messages,
-                max_tokens=settings["max_tokens"],
-                temperature=settings["temperature"],
-            )
+            if tool_phase:
+                response_text, tool_calls = await chat_completion(
+                    messages,
+                    max_tokens=settings["max_tokens"],
+                    temperature=settings["temperature"],
+                    tools=tools,
+                    tool_choice="auto" if tool_phase == "offer" else "none",
+                )
+                await record_capability(TOOLS, True)
+                if tool_phase == "offer" and tool_calls:
+                    tool_phase = "answer"
+                    tool_messages, results = await _run_tool_calls(tool_calls, tool_executor, messages, settings)
+                    messages = messages + tool_messages
+                    web_results_text = "\n\n".join(filter(None, [web_results_text] + results))
+                    continue
+            else:
+                response_text = await chat_completion(
+                    messages,
+                    max_tokens=settings["max_tokens"],
+                    temperature=settings["temperature"],
+                )
+            if image_data:
+                await record_capability(VISION, True)
             break
         except LLMRequestError as exc:
-            # Fallback for text-only models: If we have an image and it failed with a 400 or specific error
-            if image_data and (exc.status_code == 400 or "image" in str(exc).lower()):
-                logger.warning("Multimodal request failed, falling back to text-only.")
-                image_data = None # Remove image and retry
-                messages = _build_messages(
-                    history, prompt, reply_text, settings, web_context, knowledge, image_data=None
-                )
-                continue
-
+            # An overlong prompt says nothing about tools or images, so it is handled before those fallbacks.
             if history and _is_context_overflow_error(exc) and attempts < max_attempts:
                 logger.info("Context overflow, trimming history for chat %s", chat_id)
                 history = trim_oldest_history(history)
                 set_history(chat_id, history)
                 messages = _build_messages(
-                    history, prompt, reply_text, settings, web_context, knowledge
-                )
+                    history, prompt, reply_text, settings, web_context, knowledge, image_data=image_data
+                ) + tool_messages
                 attempts += 1
                 if history:
                     continue
                 attempts = max_attempts
+            if tool_phase == "offer" and is_capability_error(exc, TOOLS):
+                logger.warning("Tool calling in the reply request failed, retrying without tools: %s", exc)
+                await record_capability(TOOLS, False)
+                tool_phase = None
+                continue
+            # Fallback for text-only models: If we have an image and it failed with a 400 or specific error
+            if image_data and (is_capability_error(exc, VISION) or "image" in str(exc).lower()):
+                logger.warning("Multimodal request failed, falling back to text-only.")
+                if is_capability_error(exc, VISION):
+                    await record_capability(VISION, False)
+                image_data = None # Remove image and retry
+                messages = _build_messages(
+                    history, prompt, reply_text, settings, web_context, knowledge, image_data=None
+                ) + tool_messages
+                continue
             if _is_message_header_error(exc):
                 logger.warning("Chat template error, retrying with minimal prompt for chat %s", chat_id)
                 try:
                     response_text = await chat_completion(
-                        _build_flat_fallback_messages(history, prompt, reply_text, settings, web_context, knowledge),
+                        _build_flat_fallback_messages(
+                            history, prompt, reply_text, settings,
+                            _tool_results_context(web_context, tool_messages), knowledge,
+                        ),
                         max_tokens=settings["max_tokens"],
                         temperature=settings["temperature"],
                     )
@@ -188,8 +494,9 @@ async def process_chat_request(chat_id, prompt, reply_text, settings, web_contex
         logger.info("Empty LLM response, retrying without history for chat %s", chat_id)
         try:
             retry_system_prompt = _compose_system_prompt(settings, knowledge)
-            if web_context:
-                retry_system_prompt = f"{retry_system_prompt}\n\n{web_context}"
+            retry_context = _tool_results_context(web_context, tool_messages)
+            if retry_context:
+                retry_system_prompt = f"{retry_system_prompt}\n\n{retry_context}"
             retry_messages = [{"role": "system", "content": retry_system_prompt}]
             retry_messages.append(
                 {
@@ -215,7 +522,7 @@ async def process_chat_request(chat_id, prompt, reply_text, settings, web_contex
                 return fallback, None, None
             return None, None, "Модель вернула пустой ответ. Попробуй переформулировать."
 
-    append_history(chat_id, "user", prompt)
+    append_history(chat_id, "user", f"{prompt}\n{image_note}" if image_note else prompt)
     append_history(chat_id, "assistant", response_text)
 
     return response_text, parse_mode, None
@@ -1,6 +1,6 @@
 import logging
 from app.llm_client import chat_completion
-from app.state import get_knowledge, set_knowledge, persist_knowledge
+from app.state import get_chat_lock, get_knowledge, set_knowledge, persist_knowledge
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +21,12 @@ async def update_knowledge_base(chat_id, new_messages):
     if not new_messages:
         return
 
+    # Concurrent updates would each merge into the same old context and drop each other's facts.
+    async with get_chat_lock(chat_id, "knowledge"):
+        await _update_knowledge_base(chat_id, new_messages)
+
+
+async def _update_knowledge_base(chat_id, new_messages):
     current_kb = get_knowledge(chat_id)
     
     # Format new messages for the LLM
@@ -0,0 +1,35 @@
+from collections import defaultdict
+
+# Process-local counters and timings; cheap enough to update on every request.
+_COUNTERS = defaultdict(int)
+_GAUGES = {}
+_TIMINGS = {}
+
+
+def increment(name, value=1):
+    _COUNTERS[name] += value
+
+
+def set_gauge(name, value):
+    _GAUGES[name] = value
+
+
+def observe(name, seconds):
+    stats = _TIMINGS.get(name)
+    if stats is None:
+        stats = {"count": 0, "total": 0.0, "max": 0.0}
+        _TIMINGS[name] = stats
+    stats["count"] += 1
+    stats["total"] += seconds
+    stats["max"] = max(stats["max"], seconds)
+
+
+def get_counter(name):
+    return _COUNTERS.get(name, 0)
+
+
+def snapshot():
+    timings = {}
+    for name, stats in _TIMINGS.items():
+        timings[name] = dict(stats, avg=stats["total"] / stats["count"] if stats["count"] else 0.0)
+    return {"counters": dict(_COUNTERS), "gauges": dict(_GAUGES), "timings": timings}
@@ -0,0 +1,234 @@
+import asyncio
+import codecs
+import ipaddress
+import logging
+import re
+import socket
+from html.parser import HTMLParser
+
+import httpx
+
+from app.cache import TTLCache
+from app.config import (
+    DEEP_SEARCH_PAGES,
+    PAGE_CACHE_SIZE,
+    PAGE_CACHE_TTL,
+    PAGE_FETCH_ALLOW_PRIVATE,
+    PAGE_FETCH_MAX_BYTES,
+    PAGE_FETCH_TIMEOUT,
+    PAGE_TEXT_MAX_CHARS,
+)
+from app.metrics import increment, observe
+from app.search_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; TelegramBot/1.0; +https://core.telegram.org/bots)",
+    "Accept": "text/html,application/xhtml+xml,text/plain;q=0.9",
+}
+_TEXT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+# Failed pages are remembered briefly so the same dead link is not retried on every search.
+_FAILURE_TTL = 300
+_CHUNK_SIZE = 16 * 1024
+_MAX_REDIRECTS = 5
+
+# url -> extracted main text ("" when the page could not be fetched)
+_PAGES = TTLCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL)
+
+_SPACE_RE = re.compile(r"\s+")
+_SKIP_TAGS = {
+    "head", "title", "script", "style", "noscript", "template", "svg", "canvas", "iframe",
+    "nav", "header", "footer", "aside", "form", "button", "select", "dialog",
+}
+_MAIN_TAGS = {"main", "article"}
+_BLOCK_TAGS = {
+    "p", "div", "section", "li", "dd", "dt", "td", "th", "tr", "blockquote", "pre",
+    "h1", "h2", "h3", "h4", "h5", "h6", "br", "hr", "table", "ul", "ol", "figcaption",
+}
+# Blocks shorter than this outside <main>/<article> are usually menus, buttons and bylines.
+_MIN_BLOCK_CHARS = 60
+
+
+class MainTextParser(HTMLParser):
+    """
+    Incremental HTML-to-text extractor. Feed it chunks as they arrive; it drops
+    scripts, navigation and other page chrome and keeps the text blocks, preferring
+    those inside <main>/<article> when the page has them.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._parts = []
+        self._blocks = []
+        self._main_blocks = []
+
+    def _flush(self):
+        text = _SPACE_RE.sub(" ", "".join(self._parts)).strip()
+        self._parts = []
+        if not text:
+            return
+        if self._main_depth:
+            self._main_blocks.append(text)
+        elif len(text) >= _MIN_BLOCK_CHARS:
+            self._blocks.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if tag in _BLOCK_TAGS or tag in _MAIN_TAGS:
+            self._flush()
+        if tag in _MAIN_TAGS:
+            self._main_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if tag in _BLOCK_TAGS or tag in _MAIN_TAGS:
+            self._flush()
+        if tag in _MAIN_TAGS:
+            self._main_depth = max(0, self._main_depth - 1)
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        self._parts.append(data)
+
+    def text_length(self):
+        return sum(len(block) for block in self._main_blocks or self._blocks)
+
+    def get_text(self, max_chars=None):
+        self._flush()
+        blocks = self._main_blocks or self._blocks
+        text = "\n".join(dict.fromkeys(blocks))
+        if max_chars and len(text) > max_chars:
+            cut = text[:max_chars]
+            cut_at = max(cut.rfind("\n"), cut.rfind(". "))
+            text = cut[:cut_at + 1] if cut_at > max_chars // 2 else cut
+        return text.strip()
+
+
+def extract_main_text(html, max_chars=None):
+    parser = MainTextParser()
+    parser.feed(html)
+    parser.close()
+    return parser.get_text(max_chars)
+
+
+def _is_public_address(address):
+    address = ipaddress.ip_address(address.split("%", 1)[0])
+    return address.is_global and not address.is_multicast
+
+
+async def _is_public_url(url):
+    """
+    True if every address the URL's host resolves to is public. Result URLs come from the
+    web, so without this a page (or a redirect) could point the bot at localhost, the LAN
+    or a cloud metadata endpoint.
+    """
+    if PAGE_FETCH_ALLOW_PRIVATE:
+        return True
+    host = url.host
+    if not host:
+        return False
+    try:
+        return _is_public_address(host)
+    except ValueError:
+        pass  # a name, not an IP literal
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, url.port, type=socket.SOCK_STREAM)
+    except OSError:
+        return False
+    return bool(infos) and all(_is_public_address(info[4][0]) for info in infos)
+
+
+async def _download_text(url):
+    """Follow redirects (checking every hop), then read the page's main text."""
+    url = httpx.URL(url)
+    for _ in range(_MAX_REDIRECTS + 1):
+        if url.scheme not in ("http", "https") or not await _is_public_url(url):
+            increment("page_fetch_blocked")
+            return ""
+        async with get_http_client().stream("GET", url, headers=_HEADERS, follow_redirects=False) as response:
+            if not response.is_redirect:
+                return await _read_text(response)
+            url = url.join(response.headers["location"])
+    increment("page_fetch_too_many_redirects")
+    return ""
+
+
+async def _read_text(response):
+    """Stream the page, parsing as it arrives, and stop at PAGE_FETCH_MAX_BYTES."""
+    if response.is_error:
+        increment("page_fetch_http_errors")
+        return ""
+    content_type = response.headers.get("content-type", "text/html").casefold()
+    if not content_type.startswith(_TEXT_TYPES):
+        increment("page_fetch_skipped_type")
+        return ""
+    decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+    plain = content_type.startswith("text/plain")
+    parser = None if plain else MainTextParser()
+    parts = []
+    received = 0
+    async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+        received += len(chunk)
+        text = decoder.decode(chunk[:PAGE_FETCH_MAX_BYTES - received + len(chunk)])
+        if plain:
+            parts.append(text)
+        else:
+            parser.feed(text)
+        if received >= PAGE_FETCH_MAX_BYTES:
+            increment("page_fetch_truncated")
+            break
+        # Enough main text already; the rest of the page would be cut anyway.
+        if parser is not None and parser.text_length() >= PAGE_TEXT_MAX_CHARS * 2:
+            break
+    increment("page_fetch_bytes", received)
+    if plain:
+        text = _SPACE_RE.sub(" ", "".join(parts)).strip()
+        return text[:PAGE_TEXT_MAX_CHARS]
+    return parser.get_text(PAGE_TEXT_MAX_CHARS)
+
+
+async def fetch_page_text(url):
+    """Main text of a web page, cached per URL; empty string on any failure."""
+    if not url or not url.startswith(("http://", "https://")):
+        return ""
+    text = _PAGES.get(url)
+    if text is not None:
+        increment("page_cache_hits")
+        return text
+    increment("page_cache_misses")
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        text = await asyncio.wait_for(_download_text(url), PAGE_FETCH_TIMEOUT)
+    except (httpx.HTTPError, httpx.InvalidURL, asyncio.TimeoutError, UnicodeError, LookupError) as exc:
+        logger.debug("Failed to fetch %s: %s", url, exc)
+        increment("page_fetch_errors")
+        text = ""
+    observe("page_fetch", loop.time() - started)
+    _PAGES.set(url, text, None if text else _FAILURE_TTL)
+    return text
+
+
+async def fetch_pages(results, limit=None):
+    """
+    Fetch the top `limit` (DEEP_SEARCH_PAGES) result pages concurrently and return
+    copies of `results` where those items carry the extracted text under "content".
+    """
+    limit = DEEP_SEARCH_PAGES if limit is None else limit
+    top = results[:limit]
+    texts = await asyncio.gather(*(fetch_page_text(item.get("url")) for item in top))
+    enriched = []
+    for index, item in enumerate(results):
+        item = dict(item)
+        if index < len(texts) and texts[index]:
+            item["content"] = texts[index]
+        enriched.append(item)
+    return enriched
@@ -0,0 +1,110 @@
+import re
+
+from app.bm25 import BM25Index, tokenize
+from app.text_utils import _estimate_tokens_for_length
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+# Shorter pieces are mostly dates, bylines and "Read more" leftovers.
+_MIN_PASSAGE_CHARS = 25
+# Passages sharing this share of their terms with an already kept one are treated as duplicates.
+_DUPLICATE_OVERLAP = 0.8
+# Small bonus for the provider's own ranking, so it breaks ties between equally relevant passages.
+_RANK_BONUS = 0.3
+
+
+def _passages(results):
+    """(result index, position, text) for every sentence of every snippet and page text."""
+    passages = []
+    for index, item in enumerate(results):
+        position = 0
+        for field in ("snippet", "content"):
+            for sentence in _SENTENCE_RE.split(item.get(field) or ""):
+                sentence = sentence.strip()
+                if len(sentence) >= _MIN_PASSAGE_CHARS:
+                    passages.append((index, position, sentence))
+                    position += 1
+        snippet = (item.get("snippet") or "").strip()
+        if not position and snippet:
+            # A terse snippet is still better than dropping the result altogether.
+            passages.append((index, position, _SENTENCE_RE.sub(" ", snippet)))
+    return passages
+
+
+def _is_duplicate(terms, kept_terms):
+    if not terms:
+        return True
+    for other in kept_terms:
+        overlap = len(terms & other) / min(len(terms), len(other))
+        if overlap >= _DUPLICATE_OVERLAP:
+            return True
+    return False
+
+
+def _header(index, item):
+    title = (item.get("title") or "").strip() or "Untitled"
+    url = (item.get("url") or "").strip()
+    return f"{index + 1}. {title}\n{url}" if url else f"{index + 1}. {title}"
+
+
+def _render(query, results, chosen):
+    lines = [f"Search results for query: {query}"]
+    by_result = {}
+    for index, position, sentence in sorted(chosen):
+        by_result.setdefault(index, []).append(sentence)
+    for index, sentences in by_result.items():
+        lines.append("")
+        lines.append(_header(index, results[index]))
+        lines.append(" ".join(sentences))
+    return "\n".join(lines)
+
+
+def build_search_context(query, results, max_tokens):
+    """
+    Format search results for the prompt from their most query-relevant sentences.
+
+    Snippet and page sentences are scored with BM25 against the query, near-duplicates
+    are dropped, and the best ones are added until the formatted text would exceed
+    `max_tokens`. Sentences are printed grouped under their result, in reading order.
+    """
+    if not results or max_tokens <= 0:
+        return ""
+    passages = _passages(results)
+    passage_tokens = [tokenize(sentence) for _, _, sentence in passages]
+    index = BM25Index()
+    for passage_id, (_, _, sentence) in enumerate(passages):
+        index.add(passage_id, sentence, passage_tokens[passage_id])
+    relevance = dict(index.search(query, limit=len(passages)))
+
+    def score(passage_id):
+        result_index, position, _ = passages[passage_id]
+        return relevance.get(passage_id, 0.0) + _RANK_BONUS / (1 + result_index + position)
+
+    candidates = sorted(range(len(passages)), key=score, reverse=True)
+    if relevance:
+        # Sentences sharing no term with the query only cost tokens; keep them only when nothing matched.
+        candidates = [passage_id for passage_id in candidates if relevance.get(passage_id)]
+
+    chosen = []
+    kept_terms = []
+    headed = set()
+    length = len(_render(query, results, chosen))
+    for passage_id in candidates:
+        passage = passages[passage_id]
+        # Mirrors _render: a blank line, header and newline before a result's first sentence, a space before the rest.
+        result_index = passage[0]
+        if result_index in headed:
+            added = 1 + len(passage[2])
+        else:
+            added = 2 + len(_header(result_index, results[result_index])) + 1 + len(passage[2])
+        if _estimate_tokens_for_length(length + added) > max_tokens:
+            continue
+        terms = set(passage_tokens[passage_id])
+        if _is_duplicate(terms, kept_terms):
+            continue
+        chosen.append(passage)
+        kept_terms.append(terms)
+        headed.add(result_index)
+        length += added
+    if not chosen:
+        return ""
+    return _render(query, results, chosen)
@@ -1,23 +1,103 @@
 import httpx
 import asyncio
-from ddgs import DDGS
+import importlib.util
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
+from app.cache import TTLCache
 from app.config import (
+    SEARCH_ANSWER_CACHE_SIZE,
+    SEARCH_ANSWER_TTLS,
+    SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL,
     WEB_SEARCH_API_KEY,
+    WEB_SEARCH_FANOUT,
+    WEB_SEARCH_FANOUT_DEADLINE,
     WEB_SEARCH_MAX_RESULTS,
     WEB_SEARCH_PROVIDER,
+    WEB_SEARCH_PROVIDERS,
+    WEB_SEARCH_SERPER_URL,
     WEB_SEARCH_TIMEOUT,
 )
+from app.metrics import increment, observe
 
 
 class WebSearchError(RuntimeError):
     pass
 
 
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# One pooled client for all HTTP search traffic, so repeated queries reuse keep-alive connections.
+_http_client = None
+
+# DDGS sessions are not shared between threads; each worker keeps its own for the life of the process.
+_ddg_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ddgs")
+_ddg_local = threading.local()
+
+# (normalized query, provider, limit) -> provider results
+_RESULTS = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+# (normalized query, provider, limit) -> task running a search already in progress
+_inflight = {}
+# (normalized query, provider, max_tokens) -> summarized answer
+_ANSWERS = TTLCache(SEARCH_ANSWER_CACHE_SIZE, SEARCH_ANSWER_TTLS["default"])
+
+_SPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,!?;:\"'«»()"
+# Answers about these change within hours, so they are kept only briefly.
+_FRESH_RE = re.compile(
+    r"\b(погод|новост|сегодня|сейчас|вчера|завтра|курс|цен[аы]|стоимост|счет|матч|выбор|пробк|"
+    r"weather|news|today|now|latest|price|rate|score|stock)",
+    re.IGNORECASE,
+)
+# Definitions and biographies barely change, so they are kept longest.
+_REFERENCE_RE = re.compile(
+    r"^(кто так|что так|что значит|что означает|как расшифр|определение|"
+    r"who (is|was)|what (is|are|does)|define|meaning of)",
+    re.IGNORECASE,
+)
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WEB_SEARCH_TIMEOUT),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            http2=_HTTP2_AVAILABLE,
+        )
+    return _http_client
+
+
+async def close_search_clients():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    _ddg_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_ddgs():
+    ddgs = getattr(_ddg_local, "ddgs", None)
+    if ddgs is None:
+        from ddgs import DDGS
+
+        ddgs = DDGS(timeout=WEB_SEARCH_TIMEOUT)
+        _ddg_local.ddgs = ddgs
+    return ddgs
+
+
 def _ddg_search_sync(query, limit):
     try:
-        with DDGS() as ddgs:
-            raw_results = list(ddgs.text(query, max_results=limit))
+        try:
+            raw_results = list(_get_ddgs().text(query, max_results=limit))
+        except Exception:
+            # Start over with a fresh session in case the old one went bad.
+            _ddg_local.ddgs = None
+            raise
         results = []
         for item in raw_results:
             results.append({
@@ -31,18 +111,19 @@ def _ddg_search_sync(query, limit):
 
 
 async def _search_duckduckgo(query, limit):
-    return await asyncio.to_thread(_ddg_search_sync, query, limit)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_ddg_executor, _ddg_search_sync, query, limit)
 
 
 async def _search_serper(query, limit):
     if not WEB_SEARCH_API_KEY:
         raise WebSearchError("WEB_SEARCH_API_KEY is required for serper.")
-    url = "https://google.serper.dev/search"
     headers = {"X-API-KEY": WEB_SEARCH_API_KEY}
     payload = {"q": query, "num": limit}
-    timeout = httpx.Timeout(WEB_SEARCH_TIMEOUT)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(url, json=payload, headers=headers)
+    try:
+        response = await get_http_client().post(WEB_SEARCH_SERPER_URL, json=payload, headers=headers)
+    except httpx.HTTPError as exc:
+        raise WebSearchError(f"Serper request failed: {exc}") from exc
     if response.is_error:
         detail = response.text
         if detail and len(detail) > 1000:
@@ -62,15 +143,198 @@ async def _search_serper(query, limit):
     return results
 
 
+def _providers():
+    if WEB_SEARCH_PROVIDERS:
+        return list(dict.fromkeys(WEB_SEARCH_PROVIDERS))
+    return [(WEB_SEARCH_PROVIDER or "duckduckgo").strip().casefold()]
+
+
+def _provider_key():
+    """Part of the cache keys that changes whenever the provider setup does."""
+    providers = _providers()
+    if len(providers) == 1:
+        return providers[0]
+    return f"{WEB_SEARCH_FANOUT}:{','.join(providers)}"
+
+
+def normalize_query(query):
+    """Cache key form of a query: case, spacing, "ё" and surrounding punctuation do not matter."""
+    text = unicodedata.normalize("NFKC", query or "").casefold().replace("ё", "е")
+    return _SPACE_RE.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+def query_category(query):
+    """Return "fresh", "reference" or "default", which selects the answer cache TTL."""
+    text = normalize_query(query)
+    if _FRESH_RE.search(text):
+        return "fresh"
+    if _REFERENCE_RE.search(text):
+        return "reference"
+    return "default"
+
+
+async def _search_provider(provider, query, limit):
+    if provider in {"duckduckgo", "ddg"}:
+        return await _search_duckduckgo(query, limit)
+    if provider in {"serper", "google"}:
+        return await _search_serper(query, limit)
+    raise WebSearchError(f"Unknown search provider: {provider}")
+
+
+async def _timed_search(provider, query, limit):
+    started = time.monotonic()
+    try:
+        results = await _search_provider(provider, query, limit)
+    except asyncio.CancelledError:
+        increment(f"search_{provider}_cancelled")
+        raise
+    except Exception:
+        increment(f"search_{provider}_errors")
+        raise
+    finally:
+        observe(f"search_{provider}", time.monotonic() - started)
+    if not results:
+        increment(f"search_{provider}_empty")
+    return results
+
+
+def _url_key(url):
+    url = (url or "").strip().casefold().split("#", 1)[0]
+    for prefix in ("https://", "http://"):
+        if url.startswith(prefix):
+            url = url[len(prefix):]
+            break
+    if url.startswith("www."):
+        url = url[4:]
+    return url.rstrip("/")
+
+
+def _merge_results(result_lists, limit):
+    """Interleave ranked lists (best of each provider first), dropping repeated URLs."""
+    merged = []
+    seen = set()
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank >= len(results):
+                continue
+            item = results[rank]
+            key = _url_key(item.get("url")) or item.get("title", "")
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(item)
+            if len(merged) >= limit:
+                return merged
+    return merged
+
+
+def _fanout_error(errors):
+    details = "; ".join(f"{provider}: {exc}" for provider, exc in errors)
+    return WebSearchError(f"All search providers failed: {details}")
+
+
+async def _first_good(tasks, errors):
+    """Wait for `tasks` (task -> provider) until one of them returns results."""
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                errors.append((tasks[task], task.exception()))
+            elif task.result():
+                increment(f"search_{tasks[task]}_wins")
+                return task.result()
+    return []
+
+
+async def _fan_out(providers, query, limit):
+    tasks = {
+        asyncio.create_task(_timed_search(provider, query, limit)): provider
+        for provider in providers
+    }
+    errors = []
+    try:
+        if WEB_SEARCH_FANOUT == "merge":
+            done, pending = await asyncio.wait(tasks, timeout=WEB_SEARCH_FANOUT_DEADLINE)
+            result_lists = []
+            # Keep the configured provider order so the first provider's ranking leads the merge.
+            for task, provider in tasks.items():
+                if task not in done:
+                    continue
+                if task.exception() is not None:
+                    errors.append((provider, task.exception()))
+                elif task.result():
+                    result_lists.append(task.result())
+            if result_lists:
+                return _merge_results(result_lists, limit)
+            # Nothing usable before the deadline: settle for whichever provider answers next.
+            results = await _first_good({task: tasks[task] for task in pending}, errors)
+        else:
+            results = await _first_good(tasks, errors)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if not results and len(errors) == len(tasks):
+        raise _fanout_error(errors)
+    return results
+
+
+async def _search(query, limit):
+    providers = _providers()
+    if len(providers) == 1:
+        return await _timed_search(providers[0], query, limit)
+    return await _fan_out(providers, query, limit)
+
+
+async def _search_and_cache(key, query, limit):
+    results = await _search(query, limit)
+    # Empty results are often a transient provider hiccup, so they are not cached.
+    if results:
+        _RESULTS.set(key, results)
+    return results
+
+
+def _forget_inflight(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        # Every caller may have given up already; the error is theirs to report, not the loop's.
+        task.exception()
+
+
 async def search_web(query, limit=None):
     if not query:
         return []
-    provider = (WEB_SEARCH_PROVIDER or "duckduckgo").strip().casefold()
     limit = limit or WEB_SEARCH_MAX_RESULTS
     if limit < 1:
         return []
-    if provider in {"duckduckgo", "ddg"}:
-        return await _search_duckduckgo(query, limit)
-    if provider in {"serper", "google"}:
-        return await _search_serper(query, limit)
-    raise WebSearchError(f"Unknown WEB_SEARCH_PROVIDER: {WEB_SEARCH_PROVIDER}")
+    key = (normalize_query(query), _provider_key(), limit)
+    results = _RESULTS.get(key)
+    if results is not None:
+        increment("search_cache_hits")
+        return list(results)
+
+    task = _inflight.get(key)
+    if task is not None:
+        increment("search_cache_joined")
+    else:
+        increment("search_cache_misses")
+        # The search runs in its own task so that cancelling whichever caller started it
+        # (a superseded reply, a tool timeout) does not cancel it for the callers that joined.
+        task = asyncio.create_task(_search_and_cache(key, query, limit))
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _forget_inflight(key, done))
+    return list(await asyncio.shield(task))
+
+
+def get_cached_answer(query, max_tokens):
+    answer = _ANSWERS.get((normalize_query(query), _provider_key(), max_tokens))
+    increment("search_answer_cache_hits" if answer is not None else "search_answer_cache_misses")
+    return answer
+
+
+def cache_answer(query, max_tokens, answer):
+    if not answer:
+        return
+    ttl = SEARCH_ANSWER_TTLS.get(query_category(query), SEARCH_ANSWER_TTLS["default"])
+    _ANSWERS.set((normalize_query(query), _provider_key(), max_tokens), answer, ttl)
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+from app.config import (
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_GROUP_BURST,
+    TELEGRAM_GROUP_RATE_PER_MIN,
+    TELEGRAM_SEND_MAX_RETRIES,
+)
+from app.metrics import increment, observe, set_gauge
+
+logger = logging.getLogger(__name__)
+
+_MAX_IDLE_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one can be taken right now)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+def _retry_after_seconds(exc):
+    value = exc.retry_after
+    if hasattr(value, "total_seconds"):
+        value = value.total_seconds()
+    return float(value)
+
+
+class SendScheduler:
+    """
+    Paces outgoing Telegram calls through a global token bucket and one bucket
+    per chat, backs off on RetryAfter and merges queued edits of one message.
+    """
+
+    def __init__(self, global_rate, chat_rate, chat_burst, group_rate, group_burst, max_retries):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._max_retries = max_retries
+        self._chats = {}
+        self._pending_edits = {}
+        self._queued = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                for key in [key for key, item in self._chats.items() if item.is_idle(now)]:
+                    del self._chats[key]
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, bucket):
+        while True:
+            now = time.monotonic()
+            wait = max(self._global.delay(now), bucket.delay(now))
+            if wait <= 0:
+                self._global.consume()
+                bucket.consume()
+                return
+            await asyncio.sleep(wait)
+
+    async def send(self, chat_id, call):
+        """Run `call()` (a coroutine factory) once the rate limits for `chat_id` allow it."""
+        bucket = self._chat_bucket(chat_id)
+        self._queued += 1
+        set_gauge("send_queue_depth", self._queued)
+        queued_at = time.monotonic()
+        try:
+            attempt = 0
+            while True:
+                await self._acquire(bucket)
+                if attempt == 0:
+                    observe("send_queue_wait", time.monotonic() - queued_at)
+                try:
+                    result = await call()
+                    increment("send_calls")
+                    return result
+                except RetryAfter as exc:
+                    delay = _retry_after_seconds(exc)
+                    increment("send_retry_after")
+                    logger.warning("Telegram flood limit hit in chat %s, retrying in %.1fs", chat_id, delay)
+                    if attempt >= self._max_retries:
+                        raise
+                    bucket.block(delay)
+                    attempt += 1
+        finally:
+            self._queued -= 1
+            set_gauge("send_queue_depth", self._queued)
+
+    async def edit(self, chat_id, message_id, call):
+        """
+        Like send(), but an edit still waiting in the queue is replaced by a newer
+        edit of the same message; every caller gets the result of the one sent.
+        """
+        key = (chat_id, message_id)
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            pending["call"] = call
+            increment("send_edits_merged")
+            return await asyncio.shield(pending["future"])
+
+        pending = {"call": call, "future": asyncio.get_running_loop().create_future()}
+        self._pending_edits[key] = pending
+
+        def run_latest():
+            # From now on newer edits queue up separately instead of joining this one.
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            return pending["call"]()
+
+        try:
+            result = await self.send(chat_id, run_latest)
+        except BaseException as exc:
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            future = pending["future"]
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+                # Merged callers re-raise it themselves; nobody else needs to see it logged.
+                future.exception()
+            raise
+        pending["future"].set_result(result)
+        return result
+
+
+_scheduler = SendScheduler(
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_RATE_PER_MIN / 60,
+    TELEGRAM_GROUP_BURST,
+    TELEGRAM_SEND_MAX_RETRIES,
+)
+
+
+async def schedule_send(chat_id, call):
+    return await _scheduler.send(chat_id, call)
+
+
+async def schedule_edit(chat_id, message_id, call):
+    return await _scheduler.edit(chat_id, message_id, call)
@@ -2,6 +2,7 @@ import json
 from pathlib import Path
 import random
 import asyncio
+import time
 
 import aiofiles
 from app.config import (
@@ -12,8 +13,10 @@ from app.config import (
     ENFORCE_LAST_MESSAGE_PRIORITY,
     FORMAT_WITH_LLM,
     HISTORY_LIMIT,
+    MESSAGE_DEBOUNCE_SECONDS,
     MAX_RESPONSE_CHARS,
     MAX_TOKENS,
+    PHOTO_DESCRIPTION_CACHE_SIZE,
     PLAIN_TEXT_OUTPUT,
     RENDER_MARKDOWN,
     RESPONSE_FORMAT,
@@ -21,6 +24,8 @@ from app.config import (
     RANDOM_QUESTION_PROBABILITY,
     RANDOM_PARTICIPATION_PROBABILITY,
     STRIP_MARKDOWN,
+    STT_LANGUAGE_CONFIRMATIONS,
+    STT_LANGUAGE_HINT_USES,
     SYSTEM_PROMPT,
     TEMPERATURE,
     TRIGGER_WORD,
@@ -40,18 +45,31 @@ CHAT_KNOWLEDGE = {}
 CHAT_SETTINGS = {}
 CHAT_SEEN_USERS = {}
 CHAT_LOGS = {}
+CHAT_SUMMARIES = {}
+# file_unique_id -> description, oldest first
+PHOTO_DESCRIPTIONS = {}
 LAST_RAW_TRANSCRIPTION = {}
+# chat_id -> {"language", "streak": detections in a row, "uses": messages transcribed with it since}
+DETECTED_LANGUAGES = {}
 
 DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 CHAT_SETTINGS_FILE = DATA_DIR / "chat_settings.json"
 CHAT_HISTORY_FILE = DATA_DIR / "chat_history.json"
 CHAT_KNOWLEDGE_FILE = DATA_DIR / "chat_knowledge.json"
 CHAT_LOGS_FILE = DATA_DIR / "chat_logs.json"
+CHAT_SUMMARIES_FILE = DATA_DIR / "chat_summaries.json"
+PHOTO_DESCRIPTIONS_FILE = DATA_DIR / "photo_descriptions.json"
 
 _settings_lock = asyncio.Lock()
 _history_lock = asyncio.Lock()
 _knowledge_lock = asyncio.Lock()
 _logs_lock = asyncio.Lock()
+_summaries_lock = asyncio.Lock()
+_photos_lock = asyncio.Lock()
+_pending_writes = set()
+
+# Per-chat locks for read-modify-write sequences that span awaits (e.g. an LLM call).
+_chat_locks = {}
 
 PERSONAS = {
     "default": {
@@ -103,9 +121,11 @@ DEFAULT_SETTINGS = {
     "pending_action": "",
     "pending_user_id": None,
     "voice_response": False,
+    "stt_language": "",
     "random_questions": RANDOM_QUESTIONS,
     "random_question_prob": RANDOM_QUESTION_PROBABILITY,
     "random_participation_prob": RANDOM_PARTICIPATION_PROBABILITY,
+    "debounce_seconds": MESSAGE_DEBOUNCE_SECONDS,
 }
 
 
@@ -170,38 +190,61 @@ async def load_persisted_chat_settings():
         except (OSError, json.JSONDecodeError):
             pass
 
+    # Load cached chat summaries
+    if CHAT_SUMMARIES_FILE.exists():
+        try:
+            async with aiofiles.open(CHAT_SUMMARIES_FILE, "r", encoding="utf-8") as stream:
+                content = await stream.read()
+                raw = json.loads(content)
+                for raw_chat_id, summaries in raw.items():
+                    try:
+                        chat_id = int(raw_chat_id)
+                        CHAT_SUMMARIES[chat_id] = summaries
+                    except (TypeError, ValueError):
+                        continue
+        except (OSError, json.JSONDecodeError):
+            pass
 
-async def _write_chat_settings():
-    async with _settings_lock:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        payload = {str(chat_id): settings for chat_id, settings in CHAT_SETTINGS.items()}
+    # Load photo descriptions
+    if PHOTO_DESCRIPTIONS_FILE.exists():
         try:
-            async with aiofiles.open(CHAT_SETTINGS_FILE, "w", encoding="utf-8") as stream:
-                await stream.write(json.dumps(payload, ensure_ascii=False, indent=2))
-        except OSError:
-            return
+            async with aiofiles.open(PHOTO_DESCRIPTIONS_FILE, "r", encoding="utf-8") as stream:
+                content = await stream.read()
+                raw = json.loads(content)
+                for photo_id, description in raw.items():
+                    if isinstance(description, str):
+                        PHOTO_DESCRIPTIONS[photo_id] = description
+        except (OSError, json.JSONDecodeError):
+            pass
 
 
-async def _write_chat_history():
-    async with _history_lock:
+async def _write_chat_map(lock, path, mapping):
+    # Writes for the same file are coalesced: a write still waiting for the lock
+    # snapshots the newest state when it runs, so further requests can just join it.
+    if lock in _pending_writes:
+        return
+    _pending_writes.add(lock)
+    async with lock:
+        _pending_writes.discard(lock)
         DATA_DIR.mkdir(parents=True, exist_ok=True)
-        payload = {str(chat_id): history for chat_id, history in CHAT_MEMORY.items()}
+        payload = {str(chat_id): value for chat_id, value in mapping.items()}
         try:
-            async with aiofiles.open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as stream:
+            async with aiofiles.open(path, "w", encoding="utf-8") as stream:
                 await stream.write(json.dumps(payload, ensure_ascii=False, indent=2))
         except OSError:
             return
 
 
+async def _write_chat_settings():
+    await _write_chat_map(_settings_lock, CHAT_SETTINGS_FILE, CHAT_SETTINGS)
+
+
+async def _write_chat_history():
+    await _write_chat_map(_history_lock, CHAT_HISTORY_FILE, CHAT_MEMORY)
+
+
 async def _write_chat_knowledge():
-    async with _knowledge_lock:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        payload = {str(chat_id): knowledge for chat_id, knowledge in CHAT_KNOWLEDGE.items()}
-        try:
-            async with aiofiles.open(CHAT_KNOWLEDGE_FILE, "w", encoding="utf-8") as stream:
-                await stream.write(json.dumps(payload, ensure_ascii=False, indent=2))
-        except OSError:
-            return
+    await _write_chat_map(_knowledge_lock, CHAT_KNOWLEDGE_FILE, CHAT_KNOWLEDGE)
 
 
 async def persist_settings():
@@ -215,14 +258,7 @@ async def persist_knowledge():
 
 
 async def _write_chat_logs():
-    async with _logs_lock:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        payload = {str(chat_id): logs for chat_id, logs in CHAT_LOGS.items()}
-        try:
-            async with aiofiles.open(CHAT_LOGS_FILE, "w", encoding="utf-8") as stream:
-                await stream.write(json.dumps(payload, ensure_ascii=False, indent=2))
-        except OSError:
-            return
+    await _write_chat_map(_logs_lock, CHAT_LOGS_FILE, CHAT_LOGS)
 
 
 async def persist_logs():
@@ -246,6 +282,42 @@ async def clear_chat_logs(chat_id):
     await persist_logs()
 
 
+async def _write_chat_summaries():
+    await _write_chat_map(_summaries_lock, CHAT_SUMMARIES_FILE, CHAT_SUMMARIES)
+
+
+async def persist_summaries():
+    await _write_chat_summaries()
+
+
+def get_summary_cache(chat_id):
+    cache = CHAT_SUMMARIES.setdefault(chat_id, {})
+    cache.setdefault("chunks", {})
+    cache.setdefault("final", {})
+    return cache
+
+
+def get_photo_description(photo_id):
+    return PHOTO_DESCRIPTIONS.get(photo_id, "")
+
+
+async def set_photo_description(photo_id, description):
+    PHOTO_DESCRIPTIONS.pop(photo_id, None)
+    PHOTO_DESCRIPTIONS[photo_id] = description
+    while len(PHOTO_DESCRIPTIONS) > PHOTO_DESCRIPTION_CACHE_SIZE:
+        del PHOTO_DESCRIPTIONS[next(iter(PHOTO_DESCRIPTIONS))]
+    await _write_chat_map(_photos_lock, PHOTO_DESCRIPTIONS_FILE, PHOTO_DESCRIPTIONS)
+
+
+def get_chat_lock(chat_id, scope="history"):
+    key = (chat_id, scope)
+    lock = _chat_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[key] = lock
+    return lock
+
+
 def get_settings(chat_id):
     settings = CHAT_SETTINGS.get(chat_id)
     if settings is None:
@@ -287,6 +359,36 @@ def set_raw_transcription(chat_id, text):
 def get_raw_transcription(chat_id):
     return LAST_RAW_TRANSCRIPTION.get(chat_id, "Нет сохраненной транскрибации.")
 
+
+def get_stt_language_hint(chat_id):
+    """
+    Language to transcribe the chat's next voice message in, or None to detect it.
+    The stt_language setting wins; otherwise a language learned from recent detections
+    is used for up to STT_LANGUAGE_HINT_USES messages before it is checked again.
+    """
+    language = get_settings(chat_id).get("stt_language")
+    if language:
+        return language
+    learned = DETECTED_LANGUAGES.get(chat_id)
+    if not learned or learned["streak"] < STT_LANGUAGE_CONFIRMATIONS:
+        return None
+    if learned["uses"] >= STT_LANGUAGE_HINT_USES:
+        return None
+    learned["uses"] += 1
+    return learned["language"]
+
+
+def record_detected_language(chat_id, language):
+    """Count same-language detections in a row; a different language starts the count over."""
+    if not language:
+        return
+    learned = DETECTED_LANGUAGES.get(chat_id)
+    if learned and learned["language"] == language:
+        learned["streak"] += 1
+        learned["uses"] = 0
+    else:
+        DETECTED_LANGUAGES[chat_id] = {"language": language, "streak": 1, "uses": 0}
+
 def get_knowledge(chat_id):
     return CHAT_KNOWLEDGE.get(chat_id, "")
 
@@ -313,7 +415,8 @@ def get_history(chat_id):
 
 def append_history(chat_id, role, content):
     history = get_history(chat_id)
-    history.append({"role": role, "content": content})
+    # "ts" lets archive recall skip what the history already covers; LLM requests ignore it.
+    history.append({"role": role, "content": content, "ts": time.time()})
     # For dynamic memory, we can keep a slightly larger buffer in CHAT_MEMORY
     # but the KB will hold the long-term context.
     max_items = max(HISTORY_LIMIT * 2, 6) 
@@ -321,6 +424,16 @@ def append_history(chat_id, role, content):
         del history[:-max_items]
 
 
+def annotate_history(chat_id, marker, text):
+    """Replace a placeholder left in a history entry once the text it stands for is known."""
+    for entry in get_history(chat_id):
+        content = entry.get("content")
+        if isinstance(content, str) and marker in content:
+            entry["content"] = content.replace(marker, text)
+            return True
+    return False
+
+
 def trim_oldest_history(history):
     if len(history) >= 2:
         return history[2:]
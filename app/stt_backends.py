@@ -0,0 +1,119 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class STTBackendError(RuntimeError):
+    """Raised when a speech-to-text backend cannot be loaded."""
+
+
+class WhisperBackend:
+    """Reference openai-whisper model, fp32 on CPU and fp16 on CUDA."""
+
+    name = "whisper"
+
+    def __init__(self, model_size):
+        self.model_size = model_size
+        self._model = None
+
+    def _load_model(self):
+        import whisper
+
+        return whisper.load_model(self.model_size)
+
+    def load(self):
+        if self._model is None:
+            try:
+                self._model = self._load_model()
+            except ImportError as exc:
+                raise STTBackendError(f"{self.name} backend is not installed: {exc}") from exc
+            logger.info("Loaded %s speech model (%s)", self.name, self.model_size)
+        return self
+
+    def transcribe(self, audio, language=None):
+        """Transcribe 16 kHz float32 audio; returns (text, language code)."""
+        fp16 = self._model.device.type == "cuda"
+        result = self._model.transcribe(audio, language=language, fp16=fp16)
+        return result.get("text", "").strip(), result.get("language") or language
+
+
+def _to_plain_linear(module, torch):
+    """
+    Replace nn.Linear subclasses with plain nn.Linear sharing their weights. Whisper's
+    projections are whisper.model.Linear, and quantize_dynamic only converts modules
+    whose type is exactly one of its spec (from_float asserts it, too).
+    """
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            plain.weight = child.weight
+            plain.bias = child.bias
+            setattr(module, name, plain)
+        else:
+            _to_plain_linear(child, torch)
+
+
+class QuantizedWhisperBackend(WhisperBackend):
+    """openai-whisper with its Linear layers dynamically quantized to int8 (CPU only)."""
+
+    name = "whisper-int8"
+
+    def _load_model(self):
+        import torch
+        import whisper
+
+        model = whisper.load_model(self.model_size, device="cpu")
+        _to_plain_linear(model, torch)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        quantized = sum(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules())
+        if not quantized:
+            raise STTBackendError(f"{self.name}: no Linear layer was quantized")
+        logger.info("Quantized %d Linear layers of the %s speech model to int8", quantized, self.model_size)
+        return model
+
+
+class FasterWhisperBackend:
+    """CTranslate2 port of Whisper (faster-whisper package), int8 on CPU by default."""
+
+    name = "faster-whisper"
+
+    def __init__(self, model_size, compute_type="int8", device="cpu"):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.device = device
+        self._model = None
+
+    def load(self):
+        if self._model is None:
+            try:
+                from faster_whisper import WhisperModel
+            except ImportError as exc:
+                raise STTBackendError(f"{self.name} backend is not installed: {exc}") from exc
+            self._model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type)
+            logger.info(
+                "Loaded %s speech model (%s, %s on %s)", self.name, self.model_size, self.compute_type, self.device
+            )
+        return self
+
+    def transcribe(self, audio, language=None):
+        segments, info = self._model.transcribe(audio, language=language)
+        # Segments are generated lazily; joining them runs the actual decoding.
+        text = "".join(segment.text for segment in segments)
+        return text.strip(), info.language or language
+
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    QuantizedWhisperBackend.name: QuantizedWhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(name, model_size, compute_type="int8", device="cpu"):
+    """Build (without loading) the backend registered under `name`."""
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise STTBackendError(f"Unknown STT backend: {name} (expected one of {', '.join(BACKENDS)})")
+    if backend_class is FasterWhisperBackend:
+        return backend_class(model_size, compute_type, device)
+    return backend_class(model_size)
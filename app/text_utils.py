@@ -1,8 +1,17 @@
+import base64
+import binascii
 import math
+import struct
 
 from telegram.constants import ChatType
 
-from app.config import MAX_TELEGRAM_MESSAGE, TOKEN_CHAR_RATIO
+from app.config import (
+    MAX_TELEGRAM_MESSAGE,
+    TOKEN_CHAR_RATIO,
+    VISION_MAX_EDGE,
+    VISION_PATCH_SIZE,
+    VISION_TOKEN_OVERHEAD,
+)
 
 
 def _normalize(text):
@@ -38,21 +47,6 @@ def _starts_with_prefix(text, prefix):
 
 
 
-def _format_search_results(results, query):
-    lines = [f"Search results for query: {query}"]
-    for idx, item in enumerate(results, 1):
-        title = (item.get("title") or "").strip() or "Untitled"
-        url = (item.get("url") or "").strip()
-        snippet = (item.get("snippet") or "").strip()
-        lines.append(f"{idx}. {title}")
-        if url:
-            lines.append(url)
-        if snippet:
-            lines.append(snippet)
-        lines.append("")
-    return "\n".join(lines).strip()
-
-
 def _is_reply_to_bot(update, bot_id):
     reply = update.message.reply_to_message
     if not reply or not reply.from_user:
@@ -155,15 +149,69 @@ def _split_message(text, limit=MAX_TELEGRAM_MESSAGE):
 def _estimate_tokens(text):
     if not text:
         return 0
+    return _estimate_tokens_for_length(len(text))
+
+
+def _estimate_tokens_for_length(length):
+    if length <= 0:
+        return 0
     ratio = TOKEN_CHAR_RATIO if TOKEN_CHAR_RATIO > 0 else 4
-    return max(1, math.ceil(len(text) / ratio))
+    return max(1, math.ceil(length / ratio))
+
+
+def _image_dimensions(data):
+    """Read (width, height) from a JPEG or PNG header without decoding the image."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos + 9 < len(data):
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            pos += 1 if marker == 0xFF else 2
+            continue
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        # SOFn markers carry the frame size; C4/C8/CC are DHT/JPG/DAC, not frames.
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def _estimate_image_tokens(url):
+    size = None
+    if url.startswith("data:") and "," in url:
+        try:
+            size = _image_dimensions(base64.b64decode(url.split(",", 1)[1]))
+        except (binascii.Error, ValueError, struct.error):
+            size = None
+    width, height = size or (VISION_MAX_EDGE, VISION_MAX_EDGE)
+    patch = VISION_PATCH_SIZE if VISION_PATCH_SIZE > 0 else 28
+    return VISION_TOKEN_OVERHEAD + math.ceil(width / patch) * math.ceil(height / patch)
+
+
+def _estimate_content_tokens(content):
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if part.get("type") == "image_url":
+                total += _estimate_image_tokens(part.get("image_url", {}).get("url", ""))
+            else:
+                total += _estimate_tokens(part.get("text", ""))
+        return total
+    return _estimate_tokens(content)
 
 
 def _estimate_messages_tokens(messages):
     total = 0
     for message in messages:
         content = message.get("content", "")
-        total += 4 + _estimate_tokens(content)
+        total += 4 + _estimate_content_tokens(content)
     return total
 
 
@@ -1,15 +1,21 @@
 import asyncio
 import logging
+import threading
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
 _silero_model = None
+_silero_lock = threading.Lock()
 _silero_sample_rate = 48000
 
 def _get_silero_model():
     global _silero_model
-    if _silero_model is None:
+    if _silero_model is not None:
+        return _silero_model
+    with _silero_lock:
+        if _silero_model is not None:
+            return _silero_model
         import torch
         logger.info("Loading local Silero TTS model (v4_ru)...")
         # CPU is sufficient for TTS here; generation is usually near-instant.
@@ -25,6 +31,10 @@ def _get_silero_model():
         _silero_model = model
     return _silero_model
 
+def warm_up():
+    """Load the model and synthesize one short phrase."""
+    _get_silero_model().apply_tts(text="Привет.", speaker="kseniya", sample_rate=_silero_sample_rate)
+
 def _generate_silero_sync(text: str, voice: str) -> bytes:
     import soundfile as sf
     
@@ -47,6 +47,12 @@ def _format_settings(settings):
         f"Случайные сообщения: {'ВКЛ' if settings.get('random_questions', True) else 'ВЫКЛ'}",
         f"Вер. вопроса: {settings.get('random_question_prob', RANDOM_QUESTION_PROBABILITY)}",
         f"Вер. участия: {settings.get('random_participation_prob', RANDOM_PARTICIPATION_PROBABILITY)}",
+        (
+            f"Склейка сообщений: {settings['debounce_seconds']} сек."
+            if settings.get("debounce_seconds")
+            else "Склейка сообщений: ВЫКЛ"
+        ),
+        f"Язык распознавания: {settings.get('stt_language') or 'авто'}",
     ]
     return "\n".join(lines)
 
@@ -72,7 +78,9 @@ def _settings_keyboard(manageable_chats=None, current_chat_id=None):
                 "cs": True if s.get("check_syntax") else False,
                 "rq": True if s.get("random_questions", True) else False,
                 "rqp": s.get("random_question_prob", RANDOM_QUESTION_PROBABILITY),
-                "rpp": s.get("random_participation_prob", RANDOM_PARTICIPATION_PROBABILITY)
+                "rpp": s.get("random_participation_prob", RANDOM_PARTICIPATION_PROBABILITY),
+                "db": s.get("debounce_seconds", 0),
+                "sl": s.get("stt_language", ""),
             })
             
         json_str = json.dumps(payload)
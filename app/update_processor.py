@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently while keeping updates
+    from the same chat in arrival order.
+
+    `max_pending_updates` bounds how many updates may be in flight or waiting
+    for their chat; `max_workers` bounds how many handlers actually run at once.
+    A worker slot is only taken once the update's chat is free, so a busy chat
+    cannot starve the others by filling the pool with blocked updates.
+    """
+
+    def __init__(self, max_workers, max_pending_updates):
+        super().__init__(max(max_workers, max_pending_updates))
+        self._workers = asyncio.Semaphore(max_workers)
+        self._chat_locks = {}
+
+    @staticmethod
+    def _chat_key(update):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = self._chat_key(update)
+        if chat_id is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = {"lock": asyncio.Lock(), "users": 0}
+            self._chat_locks[chat_id] = entry
+        entry["users"] += 1
+        try:
+            async with entry["lock"]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry["users"] -= 1
+            if not entry["users"]:
+                self._chat_locks.pop(chat_id, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._chat_locks:
+            logger.info("Update processor shut down with %d chats still busy", len(self._chat_locks))
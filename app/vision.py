@@ -0,0 +1,48 @@
+import logging
+from io import BytesIO
+
+from app.config import VISION_JPEG_QUALITY, VISION_MAX_EDGE
+
+logger = logging.getLogger(__name__)
+
+_pillow_missing_logged = False
+
+
+def prepare_image(data):
+    """
+    Downscale an image so its longer edge is at most VISION_MAX_EDGE and
+    re-encode it as JPEG. Returns the original bytes when Pillow is missing,
+    the image cannot be decoded, or a small JPEG would only grow when re-encoded.
+    """
+    global _pillow_missing_logged
+    try:
+        from PIL import Image
+    except ImportError:
+        if not _pillow_missing_logged:
+            logger.warning("Pillow is not installed, images are sent to the LLM without resizing")
+            _pillow_missing_logged = True
+        return data
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            oversized = max(image.size) > VISION_MAX_EDGE
+            image.draft("RGB", (VISION_MAX_EDGE, VISION_MAX_EDGE))
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            if oversized:
+                image.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.Resampling.LANCZOS)
+            out = BytesIO()
+            image.save(out, format="JPEG", quality=VISION_JPEG_QUALITY)
+    except (OSError, ValueError) as exc:
+        logger.warning("Failed to preprocess image, sending it unchanged: %s", exc)
+        return data
+
+    prepared = out.getvalue()
+    if not oversized and len(prepared) >= len(data) and data[:2] == b"\xff\xd8":
+        return data
+    return prepared
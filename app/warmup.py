@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+from app import audio_client, image_client, llm_client, tts_client
+from app.config import IMAGE_GENERATION_ENABLED, WARMUP_MODELS
+from app.metrics import increment, observe
+
+logger = logging.getLogger(__name__)
+
+LLM = "llm"
+WHISPER = "whisper"
+# The long-audio worker processes each hold their own copy of the speech model.
+WHISPER_WORKERS = "whisper_workers"
+TTS = "tts"
+IMAGE = "image"
+
+IDLE = "idle"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+_WARMERS = {
+    LLM: llm_client.warm_up,
+    WHISPER: audio_client.warm_up,
+    WHISPER_WORKERS: audio_client.warm_up_workers,
+    TTS: tts_client.warm_up,
+    IMAGE: image_client.warm_up,
+}
+
+# model -> task loading it; every caller waiting for a model awaits the same task
+_tasks = {}
+_states = {}
+
+
+def get_state(name):
+    return _states.get(name, IDLE)
+
+
+def is_ready(name):
+    return _states.get(name) == READY
+
+
+async def _warm(name):
+    started = time.monotonic()
+    logger.info("Warming up %s model...", name)
+    try:
+        # Loading and the dummy inference block for seconds to minutes, so they stay off the event loop.
+        await asyncio.to_thread(_WARMERS[name])
+    except Exception as exc:
+        logger.error("Warm-up of %s model failed: %s", name, exc)
+        increment(f"warmup_{name}_failed")
+        _states[name] = FAILED
+        # The next request gets a fresh attempt.
+        _tasks.pop(name, None)
+        return False
+    observe(f"warmup_{name}", time.monotonic() - started)
+    logger.info("%s model is ready (%.1fs)", name, time.monotonic() - started)
+    _states[name] = READY
+    return True
+
+
+def _start(name):
+    task = _tasks.get(name)
+    if task is None:
+        _states[name] = LOADING
+        task = asyncio.create_task(_warm(name))
+        _tasks[name] = task
+    return task
+
+
+def start_warmup():
+    """Start background loading of the models listed in WARMUP_MODELS."""
+    for name in WARMUP_MODELS:
+        if name not in _WARMERS:
+            logger.warning("Unknown model in WARMUP_MODELS: %s", name)
+            continue
+        if name == IMAGE and not IMAGE_GENERATION_ENABLED:
+            continue
+        _start(name)
+
+
+async def ensure_ready(name, timeout=None):
+    """
+    Wait until the model is loaded and warmed up, starting the load if nobody has.
+    Returns False if loading failed or did not finish within `timeout` seconds.
+    """
+    if is_ready(name):
+        return True
+    try:
+        return await asyncio.wait_for(asyncio.shield(_start(name)), timeout)
+    except asyncio.TimeoutError:
+        return False
@@ -0,0 +1,183 @@
+import asyncio
+import hmac
+import json
+import logging
+from http import HTTPStatus
+
+from telegram import Update
+
+from app.metrics import increment, snapshot
+
+logger = logging.getLogger(__name__)
+
+_SECRET_HEADER = "x-telegram-bot-api-secret-token"
+_IDLE_TIMEOUT = 75
+# Headers and body of a request that has started must arrive within this time (slow clients hold a connection).
+_REQUEST_TIMEOUT = 30
+_MAX_HEADER_LINES = 100
+
+
+class _BadRequest(Exception):
+    def __init__(self, status):
+        super().__init__(status.phrase)
+        self.status = status
+
+
+class WebhookServer:
+    """
+    Minimal asyncio HTTP/1.1 server that feeds Telegram webhook updates into
+    the application's update queue. Extra routes (health, metrics) share the
+    same listener.
+    """
+
+    def __init__(self, application, host, port, path, secret_token, max_queue=1000, max_body_bytes=1024 * 1024):
+        if not secret_token:
+            # Without it anyone who can reach the port could post updates with a forged sender.
+            raise ValueError("WebhookServer needs a secret token")
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_queue = max_queue
+        self.max_body_bytes = max_body_bytes
+        self._server = None
+        self._routes = {}
+        self.add_route("POST", path, self._handle_update)
+        self.add_route("GET", "/healthz", self._handle_health)
+        self.add_route("GET", "/metrics", self._handle_metrics)
+
+    def add_route(self, method, path, handler):
+        """Register `async handler(request) -> (status, payload[, headers])` for an exact path."""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info("Webhook server listening on %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_request(self, reader):
+        line = await asyncio.wait_for(reader.readline(), _IDLE_TIMEOUT)
+        if not line:
+            return None
+        return await asyncio.wait_for(self._read_rest(reader, line), _REQUEST_TIMEOUT)
+
+    async def _read_rest(self, reader, line):
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+
+        headers = {}
+        for _ in range(_MAX_HEADER_LINES):
+            header_line = await reader.readline()
+            if header_line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header_line.decode("latin-1").partition(":")
+            headers[name.strip().casefold()] = value.strip()
+        else:
+            raise _BadRequest(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+        if length > self.max_body_bytes:
+            raise _BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length > 0 else b""
+
+        keep_alive = version.upper() == "HTTP/1.1" and headers.get("connection", "").casefold() != "close"
+        return {
+            "method": method.upper(),
+            "path": target.split("?", 1)[0],
+            "headers": headers,
+            "body": body,
+            "keep_alive": keep_alive,
+        }
+
+    @staticmethod
+    async def _write_response(writer, status, payload=None, keep_alive=True, extra_headers=None):
+        body = json.dumps(payload if payload is not None else {"ok": status < 400}).encode("utf-8")
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        for name, value in (extra_headers or {}).items():
+            lines.append(f"{name}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except _BadRequest as exc:
+                    await self._write_response(writer, exc.status, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                handler = self._routes.get((request["method"], request["path"]))
+                if handler is None:
+                    status, payload, headers = HTTPStatus.NOT_FOUND, None, None
+                else:
+                    result = await handler(request)
+                    status, payload = result[0], result[1]
+                    headers = result[2] if len(result) > 2 else None
+                await self._write_response(writer, status, payload, request["keep_alive"], headers)
+                if not request["keep_alive"]:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as exc:
+            logger.exception("Webhook connection failed: %s", exc)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def _has_secret(self, request):
+        received = request["headers"].get(_SECRET_HEADER, "")
+        return hmac.compare_digest(received.encode("utf-8"), self.secret_token.encode("utf-8"))
+
+    async def _handle_update(self, request):
+        if not self._has_secret(request):
+            increment("webhook_rejected_secret")
+            return HTTPStatus.FORBIDDEN, None
+        queue = self.application.update_queue
+        if queue.qsize() >= self.max_queue:
+            # Telegram redelivers updates that were not acknowledged, so shedding load here is safe.
+            increment("webhook_rejected_busy")
+            return HTTPStatus.SERVICE_UNAVAILABLE, None, {"Retry-After": "1"}
+        try:
+            data = json.loads(request["body"])
+            if not isinstance(data, dict):
+                raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            logger.warning("Rejected malformed webhook update: %s", exc)
+            increment("webhook_rejected_malformed")
+            return HTTPStatus.BAD_REQUEST, None
+        if update is None:
+            return HTTPStatus.BAD_REQUEST, None
+        await queue.put(update)
+        increment("webhook_updates")
+        return HTTPStatus.OK, None
+
+    async def _handle_health(self, request):
+        return HTTPStatus.OK, {"status": "ok", "update_queue": self.application.update_queue.qsize()}
+
+    async def _handle_metrics(self, request):
+        if not self._has_secret(request):
+            return HTTPStatus.FORBIDDEN, None
+        return HTTPStatus.OK, snapshot()
@@ -0,0 +1,99 @@
+"""
+Bot cold-start import time, measured with `python -X importtime`.
+
+Usage: python benchmarks/bench_import_time.py [--module app.bot] [--runs N] [--top N] [--budget-ms MS]
+
+Imports the module in fresh interpreters, prints the median cumulative import
+time and the slowest packages of the last run, and exits with status 1 if any
+heavy optional dependency (torch, whisper, diffusers, LangChain, ddgs, ...) is
+imported at startup or the median exceeds --budget-ms. Those must only load
+on first use or in the background warm-up (app/warmup.py).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Top-level packages that must not be imported just to start the bot.
+FORBIDDEN = (
+    "torch",
+    "whisper",
+    "diffusers",
+    "transformers",
+    "soundfile",
+    "numpy",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "ddgs",
+)
+
+
+def _import_times(module):
+    """{module name: cumulative microseconds} for one fresh interpreter."""
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        sys.exit(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.bot")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=0.0, help="fail above this median (0 disables)")
+    args = parser.parse_args()
+
+    totals = []
+    times = {}
+    for _ in range(args.runs):
+        times = _import_times(args.module)
+        totals.append(times.get(args.module, 0) / 1000)
+    median = statistics.median(totals)
+    print(f"import {args.module}: median {median:.0f} ms over {args.runs} runs (min {min(totals):.0f}, max {max(totals):.0f})")
+
+    top_level = {}
+    for name, micros in times.items():
+        root = name.split(".", 1)[0]
+        if root == name:
+            top_level[root] = micros
+    print("slowest top-level packages:")
+    for name, micros in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    failed = False
+    loaded = sorted(name for name in FORBIDDEN if name in times)
+    if loaded:
+        print(f"FAIL: heavy packages imported at startup: {', '.join(loaded)}")
+        failed = True
+    if args.budget_ms and median > args.budget_ms:
+        print(f"FAIL: median {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
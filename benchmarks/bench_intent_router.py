@@ -0,0 +1,96 @@
+"""
+Accuracy and latency of the local intent router.
+
+Usage: python benchmarks/bench_intent_router.py
+
+The labeled prompts below are not part of the router's training seeds.
+"Routed locally" counts prompts answered without an LLM routing call;
+a local decision only counts as correct when it matches the label.
+"""
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+started = time.perf_counter()
+from app.intent_router import AMBIGUOUS, route  # noqa: E402
+
+IMPORT_SECONDS = time.perf_counter() - started
+
+CASES = [
+    ("нарисуй лису в лесу", "image"),
+    ("сгенерируй картинку с горами на рассвете", "image"),
+    ("draw a robot drinking coffee", "image"),
+    ("изобрази замок в облаках", "image"),
+    ("create an image of a red sports car", "image"),
+    ("погугли рецепт пиццы", "search"),
+    ("какая погода в казани", "search"),
+    ("последние новости про теслу", "search"),
+    ("найди в интернете расписание электричек", "search"),
+    ("курс евро сегодня", "search"),
+    ("latest news about the mars mission", "search"),
+    ("weather in berlin tomorrow", "search"),
+    ("сколько будет 17*23", "calculate"),
+    ("(12 + 8) / 5", "calculate"),
+    ("посчитай 2^16", "calculate"),
+    ("what is 144 / 12?", "calculate"),
+    ("который час", "datetime"),
+    ("какое сегодня число?", "datetime"),
+    ("what time is it", "datetime"),
+    ("какой сегодня день недели", "datetime"),
+    ("привет! как настроение?", "none"),
+    ("расскажи что-нибудь смешное", "none"),
+    ("что такое черная дыра", "none"),
+    ("мне скучно, давай поболтаем", "none"),
+    ("напиши хокку про дождь", "none"),
+    ("как ты думаешь, кошки умнее собак?", "none"),
+    ("объясни разницу между tcp и udp", "none"),
+    ("спасибо, очень помог", "none"),
+    ("tell me something interesting about octopuses", "none"),
+    ("how are you today?", "none"),
+    ("придумай имя для собаки", "none"),
+    ("что посоветуешь почитать на выходных", "none"),
+    # Tool keywords in another sense: wrong if routed locally to the tool.
+    ("draw conclusions from this article please", "none"),
+    ("можешь объяснить как нарисовать график функции в matplotlib?", "none"),
+    ("look up to your elders", "none"),
+    ("как будет погода в романе влиять на сюжет?", "none"),
+]
+ROUNDS = 200
+
+
+def main():
+    local = correct = wrong = 0
+    for prompt, expected in CASES:
+        intent = route(prompt)
+        if intent.name == AMBIGUOUS:
+            print(f"  ambiguous  {prompt!r} (expected {expected}, p={intent.confidence:.2f})")
+            continue
+        local += 1
+        if intent.name == expected:
+            correct += 1
+        else:
+            wrong += 1
+            print(f"  WRONG      {prompt!r}: {intent.name} (expected {expected}, p={intent.confidence:.2f})")
+
+    timings = []
+    for _ in range(ROUNDS):
+        for prompt, _ in CASES:
+            begin = time.perf_counter()
+            route(prompt)
+            timings.append(time.perf_counter() - begin)
+    timings.sort()
+
+    print(f"import + training: {IMPORT_SECONDS * 1000:.1f} ms")
+    print(f"routed locally:    {local}/{len(CASES)} ({local / len(CASES):.0%}), the rest go to the LLM router")
+    print(f"local accuracy:    {correct}/{local} ({correct / max(local, 1):.0%}), {wrong} wrong")
+    print(f"latency:           median {statistics.median(timings) * 1e6:.0f} us, "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Deep-search page fetching: one page after another versus concurrent fetch_pages,
+and again from the page cache.
+
+Usage: python benchmarks/bench_page_fetcher.py [--pages N] [--delay MS] [--size KB]
+
+Pages are generated into a temporary directory and served by a local
+http.server. --delay makes the server wait before answering each request,
+standing in for a remote site's response time.
+"""
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+HOST = "127.0.0.1"
+
+_CHROME = (
+    "<header><nav><a href='/'>Home</a> <a href='/news'>News</a> <a href='/about'>About us</a></nav></header>"
+    "<aside>Subscribe to our newsletter and follow us on all social networks for more updates.</aside>"
+)
+_FOOTER = "<footer>Copyright 2024. All rights reserved. Privacy policy. Cookie settings.</footer>"
+_PARAGRAPH = (
+    "<p>Paragraph {index} of article {page}: the main body text that a reader actually came for, "
+    "long enough to pass the block length filter and to be worth sending to the model.</p>"
+)
+
+
+def _write_pages(directory, pages, size_kb):
+    for page in range(pages):
+        body = []
+        index = 0
+        while sum(len(part) for part in body) < size_kb * 1024:
+            body.append(_PARAGRAPH.format(index=index, page=page))
+            index += 1
+        html = (
+            f"<!doctype html><html><head><title>Page {page}</title>"
+            "<script>var tracking = {user: 1};</script><style>p {margin: 0}</style></head><body>"
+            f"{_CHROME}<main><article><h1>Article {page}</h1>{''.join(body)}</article></main>{_FOOTER}"
+            "</body></html>"
+        )
+        Path(directory, f"page{page}.html").write_text(html, encoding="utf-8")
+
+
+class _SlowHandler(SimpleHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def _sequential(urls):
+    # Plain loop: each page is fully downloaded, then parsed.
+    from app.page_fetcher import extract_main_text
+    from app.search_client import get_http_client
+
+    texts = []
+    for url in urls:
+        response = await get_http_client().get(url)
+        texts.append(extract_main_text(response.text, 4000))
+    return texts
+
+
+async def _timed(name, call):
+    started = time.perf_counter()
+    result = await call()
+    print(f"{name:26} {(time.perf_counter() - started) * 1000:8.1f} ms")
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=200.0, help="milliseconds per response")
+    parser.add_argument("--size", type=int, default=200, help="approximate page body size in KB")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    # The pages are served from 127.0.0.1, which the fetcher refuses by default.
+    os.environ["PAGE_FETCH_ALLOW_PRIVATE"] = "1"
+    from app import page_fetcher
+    from app.search_client import close_search_clients
+
+    with tempfile.TemporaryDirectory() as directory:
+        _write_pages(directory, args.pages, args.size)
+        _SlowHandler.delay = args.delay / 1000
+        server = ThreadingHTTPServer((HOST, 0), functools.partial(_SlowHandler, directory=directory))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        results = [
+            {"title": f"Page {page}", "url": f"http://{HOST}:{port}/page{page}.html", "snippet": ""}
+            for page in range(args.pages)
+        ]
+        urls = [item["url"] for item in results]
+
+        print(f"{args.pages} pages of ~{args.size} KB, server delay {args.delay:.0f} ms")
+        await _timed("sequential", lambda: _sequential(urls))
+        enriched = await _timed("concurrent fetch_pages", lambda: page_fetcher.fetch_pages(results, args.pages))
+        await _timed("cached fetch_pages", lambda: page_fetcher.fetch_pages(results, args.pages))
+
+        text = enriched[0].get("content", "")
+        print(f"extracted {len(text)} chars from page 0, chrome left in: {'newsletter' in text or 'Copyright' in text}")
+        print(f"first line: {text.splitlines()[0] if text else '(empty)'}")
+
+        await close_search_clients()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Search latency with a fresh HTTP client per query versus the pooled client.
+
+Usage: python benchmarks/bench_search_client.py [--queries N] [--connect-delay MS]
+
+A local stub speaks the Serper API. --connect-delay makes it wait before
+serving each new connection, standing in for the TCP + TLS handshake to a
+remote host (loopback alone makes connection setup almost free).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+HOST = "127.0.0.1"
+
+
+class StubSerper:
+    def __init__(self, connect_delay):
+        self.connect_delay = connect_delay
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.connect_delay)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().casefold() == "content-length":
+                        length = int(value)
+                query = json.loads(await reader.readexactly(length)).get("q", "")
+                body = json.dumps({
+                    "organic": [
+                        {"title": f"{query} {i}", "link": f"https://example.com/{i}", "snippet": "stub result"}
+                        for i in range(5)
+                    ]
+                }).encode("utf-8")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1")
+                    + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _per_request_client(url, query):
+    # The previous implementation: a new AsyncClient (and connection) for every query.
+    import httpx
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(15)) as client:
+        response = await client.post(url, json={"q": query, "num": 5}, headers={"X-API-KEY": "benchmark"})
+    response.raise_for_status()
+    return response.json()
+
+
+async def _measure(name, stub, queries, call):
+    stub.connections = 0
+    timings = []
+    for index in range(queries):
+        started = time.perf_counter()
+        await call(f"query {index}")
+        timings.append(time.perf_counter() - started)
+    print(
+        f"{name:22} median {statistics.median(timings) * 1000:7.2f} ms   "
+        f"total {sum(timings) * 1000:8.1f} ms   connections {stub.connections}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--connect-delay", type=float, default=30.0, help="milliseconds")
+    args = parser.parse_args()
+
+    stub = StubSerper(args.connect_delay / 1000)
+    server = await asyncio.start_server(stub.handle, HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://{HOST}:{port}/search"
+
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    os.environ["WEB_SEARCH_API_KEY"] = "benchmark"
+    os.environ["WEB_SEARCH_SERPER_URL"] = url
+    from app import search_client
+
+    print(f"{args.queries} sequential queries, simulated connection setup {args.connect_delay:.0f} ms")
+    await _measure("new client per query", stub, args.queries, lambda query: _per_request_client(url, query))
+    await _measure("pooled client", stub, args.queries, lambda query: search_client._search_serper(query, 5))
+    await search_client.close_search_clients()
+    server.close()
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Speech-to-text backends compared by load time, real-time factor and memory.
+
+Usage: python benchmarks/bench_stt.py [--audio FILE] [--seconds N] [--backends a,b] [--model-size SIZE] [--device cpu] [--language ru]
+
+Each backend runs in its own interpreter so load time and peak memory are not
+skewed by the others. RTF is transcription time divided by audio duration
+(below 1.0 is faster than real time); it is measured on a second run, after a
+first run has warmed the model up. Without --audio a synthetic tone sequence
+is used, which is fine for speed and memory but not for comparing transcripts;
+pass a real recording (decoded with ffmpeg) for that.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+SAMPLE_RATE = 16000
+
+
+def _synthetic_audio(seconds):
+    import numpy as np
+
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    # Syllable-like bursts of changing pitch separated by short pauses.
+    pitch = 180 + 60 * np.sin(2 * np.pi * 0.7 * t)
+    envelope = (np.sin(2 * np.pi * 3 * t) > -0.3).astype(np.float32)
+    return (0.2 * envelope * np.sin(2 * np.pi * pitch * t)).astype(np.float32)
+
+
+def _rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _worker(args):
+    from app.audio_client import decode_audio
+    from app.stt_backends import create_backend
+
+    if args.audio:
+        audio = decode_audio(Path(args.audio).read_bytes())
+    else:
+        audio = _synthetic_audio(args.seconds)
+    duration = len(audio) / SAMPLE_RATE
+
+    baseline = _rss_mb()
+    started = time.perf_counter()
+    backend = create_backend(args.worker, args.model_size, args.compute_type, args.device).load()
+    load_seconds = time.perf_counter() - started
+
+    backend.transcribe(audio[:SAMPLE_RATE * 5], language=args.language)
+    started = time.perf_counter()
+    text, language = backend.transcribe(audio, language=args.language)
+    elapsed = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "load_s": load_seconds,
+        "transcribe_s": elapsed,
+        "duration_s": duration,
+        "rtf": elapsed / duration,
+        "model_mb": _rss_mb() - baseline,
+        "peak_mb": peak,
+        "language": language,
+        "text": text[:80],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", help="audio file to transcribe (any format ffmpeg reads)")
+    parser.add_argument("--seconds", type=float, default=30.0, help="length of the synthetic audio")
+    parser.add_argument("--backends", default="whisper,whisper-int8,faster-whisper")
+    parser.add_argument("--model-size", default="small")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--device", default="cpu", help="faster-whisper device: cpu, cuda or auto")
+    parser.add_argument("--language", default=None, help="language hint, e.g. ru (default: detect)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    if args.worker:
+        _worker(args)
+        return
+
+    print(f"model {args.model_size}, {args.audio or f'{args.seconds:.0f}s synthetic audio'}, language {args.language or 'auto'}")
+    print(f"{'backend':16} {'load':>8} {'RTF':>7} {'model MB':>9} {'peak MB':>8}  transcript")
+    forwarded = ["--seconds", str(args.seconds), "--model-size", args.model_size, "--compute-type", args.compute_type, "--device", args.device]
+    if args.audio:
+        forwarded += ["--audio", args.audio]
+    if args.language:
+        forwarded += ["--language", args.language]
+    for name in [item.strip() for item in args.backends.split(",") if item.strip()]:
+        completed = subprocess.run(
+            [sys.executable, __file__, *forwarded, "--worker", name],
+            capture_output=True,
+            text=True,
+        )
+        lines = completed.stdout.strip().splitlines()
+        if completed.returncode != 0 or not lines:
+            error = (completed.stderr.strip().splitlines() or ["no output"])[-1]
+            print(f"{name:16} unavailable: {error}")
+            continue
+        result = json.loads(lines[-1])
+        print(
+            f"{name:16} {result['load_s']:7.1f}s {result['rtf']:7.3f} {result['model_mb']:9.0f} "
+            f"{result['peak_mb']:8.0f}  [{result['language']}] {result['text']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
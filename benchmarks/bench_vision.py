@@ -0,0 +1,61 @@
+"""
+Compare the vision payload before and after preprocessing.
+
+Usage: python benchmarks/bench_vision.py [image ...]
+Without arguments a synthetic 2560x1920 photo-like image is used.
+"""
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+from app.text_utils import _estimate_image_tokens  # noqa: E402
+from app.vision import prepare_image  # noqa: E402
+
+ROUNDS = 10
+
+
+def _synthetic_image():
+    from PIL import Image, ImageFilter
+
+    noise = Image.effect_noise((2560, 1920), 64).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((2560, 1920)).convert("RGB")
+    image = Image.blend(noise.filter(ImageFilter.GaussianBlur(2)), gradient, 0.5)
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def _data_url(data):
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+
+
+def bench(name, data):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        prepared = prepare_image(data)
+    elapsed = (time.perf_counter() - started) / ROUNDS
+
+    before = len(_data_url(data))
+    after = len(_data_url(prepared))
+    print(f"{name}:")
+    print(f"  payload      {before / 1024:9.1f} KiB -> {after / 1024:9.1f} KiB ({after / before:.1%})")
+    print(f"  image tokens {_estimate_image_tokens(_data_url(data)):9d}     -> {_estimate_image_tokens(_data_url(prepared)):9d}")
+    print(f"  preprocess   {elapsed * 1000:9.1f} ms")
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        bench("synthetic 2560x1920", _synthetic_image())
+    for path in paths:
+        bench(path, Path(path).read_bytes())
+
+
+if __name__ == "__main__":
+    main()